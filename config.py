@@ -10,25 +10,101 @@ class Crawl:
     composers_url = 'composers.htm'
 
     STREAM_CHUNK_SIZE = 4096
+
+    max_conn = 32 # most downloads running at the same time
+    min_conn = 2 # the adaptive limit never goes below this
+    start_conn = 8 # the adaptive limit at the start of a crawl
+    slow_latency = 2.0 # seconds, slower requests make the limit go down like errors
+    page_conn = 4 # composer pages fetched at the same time
+
+    retries = 5 # more tries for timeouts, connection errors, 408, 429 and 5xx
+    backoff_base = 0.5 # seconds, the backoff before try n is random up to backoff_base * 2 ** n
+    backoff_cap = 30 # seconds, the longest backoff
+    retry_after_cap = 120 # seconds, the longest Retry-After we wait for
+    limit_per_host = 32 # open connections to one host, every file is on the same host
+    dns_cache_ttl = 300 # seconds a resolved host is kept
+    keepalive_timeout = 30 # seconds an idle connection is kept open for the next request
+    connect_timeout = 10
+    read_timeout = 60 # seconds without receiving any data
+    total_timeout = None # seconds for a whole request, None for no limit
+
+    writer_threads = 4 # threads writing the downloads to disk behind the event loop
+    write_size = 256 * 1024 # bytes, the chunks of a download are coalesced into writes of this size
+    max_buffered_bytes = 64 * 2**20 # downloaded bytes waiting to be written at most, the downloads wait for the disk past this
+    stall_threshold = 0.005 # seconds, the event loop counts as blocked when it wakes up this late
+
+    db_batch_size = 64 # downloaded files committed to the database at once
+    revalidate = True # ask the server if the files we already have changed, they are only downloaded again if they did
+    revalidate_unchanged = False # revalidate the files of composers whose page didn't change since the last crawl too
+    screen = True # only store single piano files, the rest are recorded in the database with the reason
+    merge_tracks = False # store the screened files with their tracks already merged
     
 
 class MidiFiles:
-    database = DATA_PATH / 'db.csv'
+    database = DATA_PATH / 'db.sqlite3'
+    database_export = DATA_PATH / 'db.csv'
     raw_midi_files = DATA_PATH / 'midi'
     preprocessed_csv_files = DATA_PATH / 'preprocessed'
+    corpus_path = DATA_PATH / 'corpus'
+    cache_space = DATA_PATH / 'cache'
     temp_space = DATA_PATH / 'temp'
     log_space = DATA_PATH / 'log'
     weights_path = DATA_PATH / 'models'
     generated_csv_path = DATA_PATH / 'generated_csv'
+    partial_downloads = DATA_PATH / 'partial'
+
+
+class PreprocessParameters:
+    fused = True # run every stage in memory, pass a stage to `preprocess` to use the old layout
+    dump_intermediate = False # write every stage's arrays to temp space, for debugging
+    workers = os.cpu_count() or 1 # processes working on files in parallel, 1 runs everything in this process
+    cache = True # reuse the results of midi files that didn't change since the last run
+    slowest_files = 10 # the slowest files of every stage listed in the run manifests in log space, 0 for none
+
+    t_new = 380 # ticks per beat of the preprocessed files
+    s_new = 500000 # tempo (microseconds per beat) of the preprocessed files
+
+
+class Benchmark:
+    files = 40 # midi files in the synthetic corpus
+    notes = 2000 # notes per file
+    density = 4 # notes sounding at the same time, on average
+    tempo_changes = 16 # tempo changes per file
+    seed = 0
+
+    repeats = 3 # runs of every pipeline, the median is kept
+    workers = 1
+    tolerance = 0.25 # fraction of the baseline throughput a stage can lose before it is a regression
+    min_seconds = 0.05 # stages measured for less than this aren't checked for regressions
+    baseline_path = BASE_DIR / 'benchmark_baseline.json'
+
+
+class CrawlBenchmark:
+    composers = 8
+    files_per_composer = 40
+    notes = 400 # notes per midi file, the files are about 8 bytes per note
+    latency = (0.01, 0.05) # seconds the mock server waits before every response
+    bandwidth = 4 * 2**20 # bytes per second of every file response, None for no limit
+    failure_rate = 0.0 # requests the mock server fails
+    concurrency = (1, 4, 16, 32) # download slots of the fixed runs, an adaptive run is added
 
 
 class LstmParameters:
-    transpose_offset = 12 # Should be a number between 1 and 12
+    transpose_offset = 12 # Should be a number between 1 and 12, the keys the training windows are transposed to at random, 1 for none
 
     seq_len = 50
     num_features = 26
 
     batch_size = 256
     epochs = 30
+    patience = 5 # epochs without a lower loss before training stops
+    validation_split = 0.2 # pieces held out for validation
+    shuffle_buffer = 10000 # windows shuffled at once
+    cycle_length = 16 # pieces the training windows are interleaved from at once
+    feature_memory_bytes = 512 * 2**20 # features of the last used pieces kept in memory, the rest are read from cache space
+    seed = 42
+
+    final_model_path = DATA_PATH / 'final_model.weights.h5'
 
-    final_model_path = DATA_PATH / 'final_model.weights.h5'
\ No newline at end of file
+    generation_batch_size = 64 # seeds continued at once by generate
+    eof_threshold = 0.5 # a generated sequence ends with the first event whose EOF is over this
\ No newline at end of file
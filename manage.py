@@ -27,11 +27,36 @@ class Options:
         arg = args[0] if len(args) != 0 else 10
         src.generate.main(arg)
 
+    def train(args):
+        import src.train
+
+        arg = args[0] if len(args) != 0 else config.LstmParameters.epochs
+        src.train.main(arg)
+
+    def benchmark(args):
+        import src.benchmark
+
+        src.benchmark.main(save="save" in args)
+
+    def model_check(args):
+        import src.model_check
+
+        src.model_check.main()
+
+    def crawl_benchmark(args):
+        import src.crawl_benchmark
+
+        src.crawl_benchmark.main()
+
 options = {
     "crawl": Options.crawl,
     "preprocess": Options.preprocess,
     "back_to_midi": Options.back_to_midi,
+    "train": Options.train,
     "generate": Options.generate,
+    "benchmark": Options.benchmark,
+    "crawl_benchmark": Options.crawl_benchmark,
+    "model_check": Options.model_check,
 }
 
 def main(args):
@@ -0,0 +1,251 @@
+import config, json, random, shutil, statistics, tempfile, time, mido
+from contextlib import contextmanager
+from pathlib import Path
+from src.preprocess import Preprocess
+
+# data paths of config.MidiFiles that are moved to the benchmark's own space
+SPACES = ("raw_midi_files", "preprocessed_csv_files", "corpus_path", "cache_space", "temp_space", "log_space")
+
+# name: (fused, cache)
+RUNS = {
+    "staged": (False, False),
+    "fused": (True, False),
+    "fused_cached": (True, True),
+}
+
+
+def synthetic_midi(rng, notes=2000, density=4, tempo_changes=16, ticks_per_beat=480, program=0):
+    """
+        A random single instrument MidiFile of two tracks: a conductor track with the tempo
+        changes and metadata, and a track of `program` (a piano by default) whose notes
+        overlap `density` at a time on average, with chords, pitches struck again while
+        still sounding, both kinds of note-offs, pedal and pitch bend messages.
+    """
+    mean_gap = ticks_per_beat // 4
+    messages = [] # (tick, order, message), note-offs go before the note-ons of the same tick
+
+    tick = 0
+    for i in range(notes):
+        if rng.random() < 0.7: # the rest are chords
+            tick += rng.randint(1, 2 * mean_gap)
+
+        pitch = rng.randint(21, 108)
+        duration = rng.randint(1, int(2 * density * 0.7 * mean_gap))
+
+        messages.append((tick, 1, mido.Message('note_on', note=pitch, velocity=rng.randint(1, 127))))
+        if rng.random() < 0.5:
+            messages.append((tick + duration, 0, mido.Message('note_off', note=pitch, velocity=64)))
+        else:
+            messages.append((tick + duration, 0, mido.Message('note_on', note=pitch, velocity=0)))
+
+        if i % 32 == 0:
+            messages.append((tick, 2, mido.Message('control_change', control=64, value=127 if i % 64 else 0)))
+        if i % 97 == 0:
+            messages.append((tick, 2, mido.Message('pitchwheel', pitch=rng.randint(-8192, 8191))))
+
+    end = max(message[0] for message in messages)
+
+    piano = mido.MidiTrack()
+    piano.append(mido.MetaMessage('track_name', name='Piano'))
+    piano.append(mido.Message('program_change', program=program))
+
+    last_tick = 0
+    for tick, order, message in sorted(messages, key=lambda m: (m[0], m[1])):
+        piano.append(message.copy(time=tick - last_tick))
+        last_tick = tick
+
+    conductor = mido.MidiTrack()
+    conductor.append(mido.MetaMessage('track_name', name='Synthetic'))
+    conductor.append(mido.MetaMessage('copyright', text='Benchmark'))
+    conductor.append(mido.MetaMessage('time_signature', numerator=4, denominator=4))
+    conductor.append(mido.MetaMessage('key_signature', key='C'))
+    conductor.append(mido.MetaMessage('set_tempo', tempo=rng.randint(300_000, 900_000)))
+
+    last_tick = 0
+    for tick in sorted(rng.randint(0, end) for _ in range(tempo_changes)):
+        conductor.append(mido.MetaMessage('set_tempo', tempo=rng.randint(300_000, 900_000), time=tick - last_tick))
+        conductor.append(mido.MetaMessage('marker', text=f"tempo {tick}"))
+        last_tick = tick
+
+    mid = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    mid.tracks = [conductor, piano]
+
+    return mid
+
+
+def make_corpus(path, files=config.Benchmark.files, notes=config.Benchmark.notes, density=config.Benchmark.density,
+                tempo_changes=config.Benchmark.tempo_changes, seed=config.Benchmark.seed):
+    """
+        Writes `files` synthetic midi files to path, the same ones for the same seed.
+    """
+    rng = random.Random(seed)
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    for i in range(files):
+        mid = synthetic_midi(rng, notes, density, tempo_changes, ticks_per_beat=rng.choice([96, 384, 480, 960]))
+        mid.save(path / f"synthetic_{i:04d}.mid")
+
+
+@contextmanager
+def benchmark_space(root):
+    """
+        Points the data paths of config.MidiFiles into root, and puts them and the
+        preprocess parameters back afterwards.
+    """
+    paths = {name: getattr(config.MidiFiles, name) for name in SPACES}
+    parameters = (config.PreprocessParameters.cache, config.PreprocessParameters.workers, config.PreprocessParameters.dump_intermediate)
+
+    try:
+        for name in SPACES:
+            setattr(config.MidiFiles, name, Path(root) / name)
+            (Path(root) / name).mkdir(parents=True, exist_ok=True)
+
+        yield
+    finally:
+        for name, path in paths.items():
+            setattr(config.MidiFiles, name, path)
+
+        config.PreprocessParameters.cache, config.PreprocessParameters.workers, config.PreprocessParameters.dump_intermediate = parameters
+
+
+def run_once(name, fused, files):
+    """
+        Preprocesses the corpus once from scratch (the cache is kept), returns the
+        throughput and the measured seconds of every stage and of the whole pipeline.
+    """
+    shutil.rmtree(config.MidiFiles.preprocessed_csv_files, ignore_errors=True)
+    shutil.rmtree(config.MidiFiles.corpus_path, ignore_errors=True)
+
+    start = time.perf_counter()
+    reports = Preprocess(try_to_load_progress=False).run_pipeline(fused=fused)
+    wall_time = time.perf_counter() - start
+
+    results = {}
+    for stage, report in reports.items():
+        if report.seconds:
+            results[f"{name}/{stage}"] = {
+                "files_per_sec": report.files / report.seconds,
+                "events_per_sec": report.events / report.seconds,
+                "seconds": report.seconds,
+            }
+
+    results[f"{name}/pipeline"] = {"files_per_sec": files / wall_time, "seconds": wall_time}
+
+    return results
+
+
+def run(repeats=config.Benchmark.repeats, workers=config.Benchmark.workers):
+    """
+        Runs every pipeline of RUNS `repeats` times on a synthetic corpus made from
+        config.Benchmark, the median of every metric of every stage is kept.
+    """
+    samples = {}
+
+    with tempfile.TemporaryDirectory() as root, benchmark_space(root):
+        make_corpus(config.MidiFiles.raw_midi_files, config.Benchmark.files, config.Benchmark.notes, config.Benchmark.density,
+                    config.Benchmark.tempo_changes, config.Benchmark.seed)
+
+        config.PreprocessParameters.workers = workers
+        config.PreprocessParameters.dump_intermediate = False
+
+        for name, (fused, cache) in RUNS.items():
+            config.PreprocessParameters.cache = cache
+
+            if cache: # warming up the cache, only the hits are measured
+                run_once(name, fused, config.Benchmark.files)
+
+            for _ in range(repeats):
+                for key, metrics in run_once(name, fused, config.Benchmark.files).items():
+                    samples.setdefault(key, []).append(metrics)
+
+    return {
+        key: {metric: statistics.median(sample[metric] for sample in runs) for metric in runs[0]}
+        for key, runs in samples.items()
+    }
+
+
+def settings():
+    return {
+        "files": config.Benchmark.files,
+        "notes": config.Benchmark.notes,
+        "density": config.Benchmark.density,
+        "tempo_changes": config.Benchmark.tempo_changes,
+        "seed": config.Benchmark.seed,
+        "workers": config.Benchmark.workers,
+    }
+
+
+def load_baseline(path=config.Benchmark.baseline_path):
+    if not Path(path).exists():
+        return None
+
+    with open(path, "r") as f:
+        baseline = json.load(f)
+
+    if baseline["settings"] != settings():
+        raise ValueError(f"The baseline in {path} was made with other benchmark settings, save a new one")
+
+    return baseline["results"]
+
+
+def save_baseline(results, path=config.Benchmark.baseline_path):
+    with open(path, "w") as f:
+        json.dump({"settings": settings(), "results": results}, f, indent=2, sort_keys=True)
+
+
+def find_regressions(results, baseline, tolerance=config.Benchmark.tolerance, min_seconds=config.Benchmark.min_seconds):
+    """
+        The keys whose files/sec fell more than `tolerance` below the baseline. Stages
+        that took less than min_seconds in either run are too short to time reliably
+        and are left out.
+    """
+    regressions = []
+    for key, metrics in results.items():
+        if key not in baseline:
+            continue
+
+        if min(metrics["seconds"], baseline[key].get("seconds", metrics["seconds"])) < min_seconds:
+            continue
+
+        if metrics["files_per_sec"] < baseline[key]["files_per_sec"] * (1 - tolerance):
+            regressions.append(key)
+
+    return regressions
+
+
+def report(results, baseline=None):
+    print(f"{'stage':<45}{'files/sec':>12}{'events/sec':>14}{'baseline':>12}")
+    for key, metrics in results.items():
+        events = metrics.get("events_per_sec")
+        events = f"{events:>14.0f}" if events else f"{'-':>14}"
+        base = f"{baseline[key]['files_per_sec']:>12.1f}" if baseline and key in baseline else f"{'-':>12}"
+
+        print(f"{key:<45}{metrics['files_per_sec']:>12.1f}{events}{base}")
+
+
+def main(save=False):
+    baseline = None if save else load_baseline()
+
+    results = run()
+    report(results, baseline)
+
+    if save:
+        save_baseline(results)
+        print(f"Baseline saved to {config.Benchmark.baseline_path}")
+        return
+
+    if baseline is None:
+        print(f"No baseline in {config.Benchmark.baseline_path}, run `benchmark save` to store one")
+        return
+
+    regressions = find_regressions(results, baseline)
+    if regressions:
+        raise SystemExit(f"Regressed past the baseline: {', '.join(regressions)}")
+
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
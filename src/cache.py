@@ -0,0 +1,52 @@
+import os, json, hashlib, threading, numpy as np
+from pathlib import Path
+
+
+def content_key(data, params):
+    """
+        Hash of the raw bytes of a file and the parameters used to process it.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(params, sort_keys=True).encode())
+    h.update(data)
+
+    return h.hexdigest()
+
+
+class ArrayCache:
+    """
+        Content-addressed store of per-file results, an entry is either the resulting
+        array or the error the file raised so broken files aren't parsed again.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _entry(self, key, suffix):
+        return self.path / key[:2] / f"{key}{suffix}"
+
+    def get(self, key):
+        array_path = self._entry(key, ".npy")
+        if array_path.exists():
+            return np.load(array_path)
+
+        error_path = self._entry(key, ".err")
+        if error_path.exists():
+            with open(error_path, "r") as f:
+                raise ValueError(f.read())
+
+        return None
+
+    def _write(self, path, write):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        with open(temp_path, "wb") as f:
+            write(f)
+
+        os.replace(temp_path, path)
+
+    def put(self, key, array):
+        self._write(self._entry(key, ".npy"), lambda f: np.save(f, array))
+
+    def put_error(self, key, error):
+        self._write(self._entry(key, ".err"), lambda f: f.write(str(error).encode()))
@@ -0,0 +1,105 @@
+import config, os, json, shutil, tqdm, numpy as np, pandas as pd
+from pathlib import Path
+from src import events as ev
+
+EVENTS_FILE = "events.npy"
+OFFSETS_FILE = "offsets.npy"
+NAMES_FILE = "names.json"
+
+CORPUS_DTYPE = np.int32
+
+
+def pack(csv_files_path=config.MidiFiles.preprocessed_csv_files, corpus_path=config.MidiFiles.corpus_path):
+    """
+        Packs every preprocessed csv file into one (events, offsets, names) corpus, see
+        pack_pieces.
+    """
+    def pieces():
+        for name in tqdm.tqdm(sorted(os.listdir(csv_files_path)), desc="Packing corpus"):
+            try:
+                df = pd.read_csv(Path(csv_files_path) / name, usecols=list(ev.FINAL_COLUMNS))
+                yield name, df[list(ev.FINAL_COLUMNS)].to_numpy(dtype=CORPUS_DTYPE)
+            except Exception as e:
+                print("Skipping", name, e)
+
+    return pack_pieces(pieces(), corpus_path)
+
+
+def pack_pieces(pieces, corpus_path=config.MidiFiles.corpus_path):
+    """
+        Packs the (name, final array) pieces into one (events, offsets, names) corpus.
+        The events of piece i are events[offsets[i]:offsets[i+1]], in the
+        (delta_time, pitch, duration) columns of the csv files.
+    """
+    corpus_path = Path(corpus_path)
+    temp_path = corpus_path.with_name(corpus_path.name + ".tmp")
+    shutil.rmtree(temp_path, ignore_errors=True)
+    temp_path.mkdir(parents=True)
+
+    names = []
+    offsets = [0]
+    raw_path = temp_path / "events.raw"
+    with open(raw_path, "wb") as raw_file:
+        for name, piece in pieces:
+            piece = np.ascontiguousarray(piece, dtype=CORPUS_DTYPE)
+
+            raw_file.write(piece.tobytes())
+            names.append(name)
+            offsets.append(offsets[-1] + len(piece))
+
+    header = {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(CORPUS_DTYPE)),
+        'fortran_order': False,
+        'shape': (offsets[-1], len(ev.FINAL_COLUMNS)),
+    }
+    with open(temp_path / EVENTS_FILE, "wb") as events_file:
+        np.lib.format.write_array_header_2_0(events_file, header)
+        with open(raw_path, "rb") as raw_file:
+            shutil.copyfileobj(raw_file, events_file)
+    os.remove(raw_path)
+
+    np.save(temp_path / OFFSETS_FILE, np.array(offsets, dtype=np.int64))
+    with open(temp_path / NAMES_FILE, "w") as f:
+        json.dump(names, f)
+
+    shutil.rmtree(corpus_path, ignore_errors=True)
+    os.replace(temp_path, corpus_path)
+
+    return corpus_path
+
+
+def exists(corpus_path=config.MidiFiles.corpus_path):
+    return (Path(corpus_path) / NAMES_FILE).exists()
+
+
+class Corpus:
+    """
+        Memory-mapped packed corpus, pieces and windows are views into the file.
+    """
+    def __init__(self, corpus_path=config.MidiFiles.corpus_path):
+        corpus_path = Path(corpus_path)
+
+        self.events = np.load(corpus_path / EVENTS_FILE, mmap_mode='r')
+        self.offsets = np.load(corpus_path / OFFSETS_FILE)
+
+        with open(corpus_path / NAMES_FILE, "r") as f:
+            self.names = json.load(f)
+
+        self.name_to_index = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def piece(self, index):
+        if isinstance(index, str):
+            index = self.name_to_index[index]
+
+        return self.events[self.offsets[index]:self.offsets[index + 1]]
+
+    def window(self, index, start, length):
+        piece = self.piece(index)
+
+        return piece[start:start + length]
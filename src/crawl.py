@@ -1,50 +1,584 @@
 import asyncio
+import functools
+import hashlib
+import io
 import pathlib
 import re
 import random
 import os
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 import requests
-from bs4 import BeautifulSoup 
+from bs4 import BeautifulSoup, SoupStrainer
 from tqdm.asyncio import tqdm
-import pandas as pd
 import aiohttp
 import config
+from collections import namedtuple
+from mido import MidiFile
+from src.download_db import DownloadDB
+from src import smf
+from src.write_behind import WriteBehind
+from src.preprocess import single_piano, merge_midi_tracks
 
 
 STREAM_CHUNK_SIZE = config.Crawl.STREAM_CHUNK_SIZE
 
 
-async def batch_download(info, callback=None, max_conn=32, progress=True, progress_settings={}):
+class ConnectionStats:
+    """
+        Counts the requests of a session and if their connections were new or reused
+        from the pool, through the trace hooks of aiohttp.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        def count(attr):
+            async def on_event(session, context, params):
+                setattr(self, attr, getattr(self, attr) + 1)
+            return on_event
+
+        trace_config.on_request_start.append(count('requests'))
+        trace_config.on_connection_create_end.append(count('created'))
+        trace_config.on_connection_reuseconn.append(count('reused'))
+        trace_config.on_dns_cache_hit.append(count('dns_hits'))
+        trace_config.on_dns_cache_miss.append(count('dns_misses'))
+
+        return trace_config
+
+    def reuse_rate(self):
+        connections = self.created + self.reused
+        return self.reused / connections if connections else 0
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.created} new connections, {self.reused} reused "
+                f"({self.reuse_rate():.0%}), DNS cache {self.dns_hits} hits / {self.dns_misses} misses")
+
+
+class AdaptiveLimiter:
+    """
+        Async context manager that lets at most `limit` requests run at once, the limit
+        follows the server: it grows by one after `limit` fast requests in a row and is
+        halved on a server error or when the average latency goes over slow_latency, at
+        most once per `limit` requests (the ones in flight started under the old limit).
+    """
+    def __init__(self, min_limit=config.Crawl.min_conn, max_limit=config.Crawl.max_conn, start=config.Crawl.start_conn, slow_latency=config.Crawl.slow_latency):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(start, max_limit))
+        self.slow_latency = slow_latency
+
+        self.active = 0
+        self.successes = 0
+        self.since_decrease = 0
+        self.latency = None # moving average
+        self.peak = self.limit
+        self.retries = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    async def record(self, latency, error=False):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.since_decrease += 1
+
+        if error or self.latency > self.slow_latency:
+            self.successes = 0
+            if self.since_decrease >= self.limit:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.since_decrease = 0
+            return
+
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self.successes = 0
+            self.peak = max(self.peak, self.limit)
+
+            async with self.condition:
+                self.condition.notify_all()
+
+    def __str__(self):
+        latency = f"{self.latency:.2f}s" if self.latency is not None else "-"
+        return f"limit {self.limit} (peak {self.peak}, {self.min_limit}-{self.max_limit}), latency {latency}, {self.retries} retries"
+
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def retry_after(error):
+    """
+        Seconds to wait from the Retry-After header of an error response, None if there is none.
+    """
+    value = getattr(error, 'headers', None) and error.headers.get('Retry-After')
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        return int(value)
+
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+async def with_retries(request, limiter, retries=config.Crawl.retries, backoff_base=config.Crawl.backoff_base, backoff_cap=config.Crawl.backoff_cap):
+    """
+        Returns await request(), run under the limiter and tried again on timeouts,
+        connection errors and retryable statuses. The backoff is exponential with full
+        jitter, a Retry-After of the server is waited for if it is longer. Cancelling
+        stops it right away, wherever it is.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with limiter:
+                start = time.perf_counter()
+                try:
+                    result = await request()
+                except Exception as e:
+                    await limiter.record(time.perf_counter() - start, error=is_retryable(e))
+                    raise
+                await limiter.record(time.perf_counter() - start)
+
+            return result
+
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+
+            delay = random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+            wait = retry_after(e)
+            if wait is not None:
+                delay = max(delay, min(wait, config.Crawl.retry_after_cap))
+
+            limiter.retries += 1
+            await asyncio.sleep(delay)
+
+
+def create_session(stats=None, trace_configs=()):
+    """
+        One keep-alive session for a whole crawl, its connections are pooled (per host)
+        and the hosts it resolves are cached, the limits and timeouts are in config.Crawl.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.Crawl.max_conn,
+        limit_per_host=config.Crawl.limit_per_host,
+        ttl_dns_cache=config.Crawl.dns_cache_ttl,
+        keepalive_timeout=config.Crawl.keepalive_timeout,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.Crawl.total_timeout,
+        connect=config.Crawl.connect_timeout,
+        sock_read=config.Crawl.read_timeout,
+    )
+    trace_configs = list(trace_configs) + ([stats.trace_config()] if stats else [])
+
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=trace_configs)
+
+
+async def fetch_text(session, url):
+    async with session.get(url) as response:
+        response.raise_for_status()
+        return await response.text()
+
+
+async def fetch_page(session, url, parse, page_cache=None, stats=None):
+    """
+        parse(html) of the index page at url and if it changed since the last crawl:
+        (parsed, changed). With a page_cache (a DownloadDB) the request is conditional
+        on the page we have, and a page that wasn't modified isn't parsed again, what
+        was parsed from it is kept in the cache.
+    """
+    cached = page_cache.page(url) if page_cache is not None else None
+
+    headers = {}
+    if cached:
+        etag, last_modified, sha256, parsed = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304 and cached:
+            if stats:
+                stats.not_modified += 1
+            return parsed, False
+
+        response.raise_for_status()
+        html = await response.read()
+        encoding = response.get_encoding()
+        new_etag = response.headers.get('ETag')
+        new_last_modified = response.headers.get('Last-Modified')
+
+    # servers without validators send the page again, it is only parsed if it changed
+    new_sha256 = hashlib.sha256(html).hexdigest()
+    if cached and new_sha256 == sha256:
+        if stats:
+            stats.unchanged += 1
+        return parsed, False
+
+    parsed = await asyncio.to_thread(parse, html.decode(encoding, errors='replace'))
+    if stats:
+        stats.changed += 1
+
+    if page_cache is not None:
+        page_cache.add_page(url, new_etag, new_last_modified, new_sha256, parsed)
+
+    return parsed, True
+
+
+class PageStats:
+    """
+        How many index pages changed since the last crawl, and the composers that were
+        skipped because nothing about them did.
+    """
+    def __init__(self):
+        self.changed = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.skipped = 0
+
+    def __str__(self):
+        return (f"{self.changed} changed, {self.not_modified} not modified, {self.unchanged} unchanged, "
+                f"{self.skipped} composers skipped")
+
+
+DownloadResult = namedtuple('DownloadResult', ['modified', 'resumed', 'etag', 'last_modified', 'sha256', 'size', 'rejected'], defaults=[None])
+
+
+class DownloadStats:
+    """
+        Counts the files of a crawl that were downloaded, resumed or not modified, and
+        the bytes that were actually moved.
+    """
+    def __init__(self):
+        self.downloaded = 0
+        self.resumed = 0
+        self.not_modified = 0
+        self.rejected = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def add(self, result):
+        if not result.modified:
+            self.not_modified += 1
+            return
+
+        if result.rejected:
+            self.rejected += 1
+            return
+
+        self.downloaded += 1
+        self.resumed += result.resumed
+
+    def __str__(self):
+        return (f"{self.downloaded} downloaded ({self.resumed} resumed), {self.not_modified} not modified, "
+                f"{self.rejected} rejected, {self.failed} failed, {self.bytes / 2**20:.1f} MB received")
+
+
+def partial_path(url):
+    """
+        Where url is downloaded to before it is complete, the same in every run so an
+        interrupted download can be picked up.
+    """
+    return pathlib.Path(config.MidiFiles.partial_downloads) / (hashlib.sha1(url.encode()).hexdigest() + '.part')
+
+
+def hash_file(path, h):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+
+
+def resume_point(partial, validator_path):
+    """
+        (size, validator) of the partial file if it can be resumed, (0, None) if not.
+    """
+    partial.parent.mkdir(parents=True, exist_ok=True)
+    if partial.exists() and validator_path.exists():
+        return partial.stat().st_size, validator_path.read_text()
+
+    return 0, None
+
+
+def write_validator(validator_path, validator):
+    if validator:
+        validator_path.write_text(validator)
+    else:
+        validator_path.unlink(missing_ok=True)
+
+
+def discard_partial(partial, validator_path):
+    partial.unlink(missing_ok=True)
+    validator_path.unlink(missing_ok=True)
+
+
+def commit_partial(partial, path, validator_path):
+    os.replace(partial, path)
+    validator_path.unlink(missing_ok=True)
+
+
+class LoopMonitor:
+    """
+        Measures how long the event loop is blocked while it is entered: a task sleeps
+        interval seconds over and over, waking up more than threshold late means the
+        loop was busy running something else for that long.
+    """
+    def __init__(self, interval=0.01, threshold=config.Crawl.stall_threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.task = None
+
+        self.blocked = 0.0
+        self.stalls = 0
+        self.longest = 0.0
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self.watch())
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    async def watch(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+
+            if lag > self.threshold:
+                self.blocked += lag
+                self.stalls += 1
+                self.longest = max(self.longest, lag)
+
+    def __str__(self):
+        return f"blocked {self.blocked:.2f}s in {self.stalls} stalls over {self.threshold * 1000:.0f}ms, longest {self.longest * 1000:.0f}ms"
+
+
+def screen_midi(data, merge=False):
+    """
+        Returns (data to store, None) for a single piano midi file, the rule of
+        Preprocess.merge_midi_tracks, with its tracks merged into one if merge is set.
+        Anything else is (None, the reason it was rejected).
+    """
+    try:
+        programs = smf.scan(data).programs
+    except ValueError as e:
+        return None, f"Unreadable midi file: {e}"
+
+    if not single_piano(programs):
+        return None, f"Not a single piano, programs {sorted(programs)}"
+
+    if merge:
+        buffer = io.BytesIO()
+        merge_midi_tracks(MidiFile(file=io.BytesIO(data))).save(file=buffer)
+        data = buffer.getvalue()
+
+    return data, None
+
+
+async def download(session, url, path, etag=None, last_modified=None, stats=None, screen=None, writer=None):
+    """
+        Downloads url to its partial file, which is renamed over path once complete so
+        path is never half written. A partial file left by an interrupted run is resumed
+        with a Range request, If-Range makes the server send the whole file instead if it
+        changed since. With the etag and last_modified of the file at path the request is
+        conditional, and nothing is downloaded if it didn't change.
+        With screen the file is kept in memory until screen(data) returns (data to store,
+        None), or (None, reason) and nothing is stored. Returns a DownloadResult.
+        The file system is only touched through the writer (a WriteBehind, a new one
+        unless it is given), never from the event loop.
+    """
+    own_writer = writer is None
+    if own_writer:
+        writer = WriteBehind()
+
+    try:
+        return await _download(session, url, path, etag, last_modified, stats, screen, writer)
+    finally:
+        if own_writer:
+            await asyncio.to_thread(writer.shutdown)
+
+
+async def _download(session, url, path, etag, last_modified, stats, screen, writer):
+    partial = partial_path(url)
+    validator_path = partial.with_suffix('.validator')
+
+    headers = {'Accept-Encoding': 'identity'}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    # only resumed if we know which version of the file the partial one is
+    offset, validator = await writer.run(resume_point, partial, validator_path)
+    if screen:
+        offset, validator = 0, None
+    if validator:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = validator
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304:
+            return DownloadResult(False, False, etag, last_modified, None, None)
+
+        new_etag = response.headers.get('ETag')
+        new_last_modified = response.headers.get('Last-Modified')
+
+        # the partial file is stale, or the server sent a part of another version or range
+        stale = response.status == 416 or (response.status == 206 and (
+            validator not in (new_etag, new_last_modified)
+            or not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-')
+        ))
+        if stale:
+            await writer.run(discard_partial, partial, validator_path)
+            return await _download(session, url, path, etag, last_modified, stats, screen, writer)
+
+        response.raise_for_status()
+
+        h = hashlib.sha256()
+        resumed = response.status == 206
+        size = offset if resumed else 0
+
+        if screen:
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                body += chunk
+                h.update(chunk)
+                if stats:
+                    stats.bytes += len(chunk)
+
+        else:
+            if resumed:
+                await writer.run(hash_file, partial, h)
+            else:
+                validator = new_etag or new_last_modified
+                await writer.run(write_validator, validator_path, validator)
+
+            # closed even if the download is cancelled, what was received is resumed next time
+            f = writer.open(partial, 'ab' if resumed else 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    await f.write(chunk)
+                    h.update(chunk)
+                    size += len(chunk)
+                    if stats:
+                        stats.bytes += len(chunk)
+            finally:
+                await f.close()
+
+    if screen:
+        data, reason = await asyncio.to_thread(screen, bytes(body))
+        if reason:
+            return DownloadResult(True, False, new_etag, new_last_modified, h.hexdigest(), len(body), reason)
+
+        f = writer.open(partial, 'wb')
+        try:
+            await f.write(data)
+        finally:
+            await f.close()
+        await writer.run(commit_partial, partial, path, validator_path)
+
+        # the checksum and size are of the file we store, the screen may have changed it
+        sha256 = h.hexdigest() if data == body else hashlib.sha256(data).hexdigest()
+
+        return DownloadResult(True, False, new_etag, new_last_modified, sha256, len(data))
+
+    await writer.run(commit_partial, partial, path, validator_path)
+
+    return DownloadResult(True, resumed, new_etag, new_last_modified, h.hexdigest(), size)
+
+
+async def fetch_validators(session, url):
+    """
+        The (etag, last_modified) of url from a HEAD request, nothing is downloaded.
+    """
+    async with session.head(url) as response:
+        response.raise_for_status()
+        return response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+async def batch_download(info, callback=None, max_conn=config.Crawl.max_conn, progress=True, progress_settings={}, session=None, limiter=None):
+    """
+        Downloads every (url, path, *args) of info through one pooled session, a new one
+        unless it is given, callback(*args) is called after each file. The number of
+        downloads running at once is adapted by the limiter, up to max_conn, and files
+        that still fail after their retries are reported and skipped. Cancelling stops
+        every download, the partial files are resumed next time. The files are written
+        by one WriteBehind shared by the downloads.
+        Returns the ConnectionStats of the session if it was created here.
+    """
     q = asyncio.Queue()
     callback_lock = asyncio.Lock()
-    if progress:
-        pg = tqdm(total=len(info), **progress_settings)
+    pg = tqdm(total=len(info), disable=not progress, **progress_settings)
+
+    if limiter is None:
+        limiter = AdaptiveLimiter(max_limit=max_conn)
+
+    stats = None
+    own_session = session is None
+    if own_session:
+        stats = ConnectionStats()
+        session = create_session(stats)
+    writer = WriteBehind()
 
-    # TODO: handle task cancellation.
     async def worker():
         while True:
             url, path, *args = await q.get()
+            try:
+                await with_retries(lambda: download(session, url, path, writer=writer), limiter)
+                if callback:
+                    async with callback_lock:
+                        await callback(*args)
+            except Exception as e:
+                tqdm.write(f'File {url} had some error: {e}')
+            finally:
+                pg.update(1)
+                q.task_done()
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    with open(path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
-                            f.write(chunk)
-                    if progress:
-                        pg.update(1)
-                    if callback:
-                        async with callback_lock:
-                            await callback(*args)
-            q.task_done()
-        
     tasks = [asyncio.create_task(worker()) for _ in range(max_conn)]
-    for download_info in info:
-        await q.put(download_info)
-    await q.join()
-    for t in tasks:
-        t.cancel()
-    
+    try:
+        for download_info in info:
+            await q.put(download_info)
+        await q.join()
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(writer.shutdown)
+        pg.close()
+
+        if own_session:
+            await session.close()
+
+    return stats
+
 
 def generate_random_string(length=16):
     chars = [chr(i) for i in range(ord('a'), ord('z')+1)]
@@ -53,9 +587,9 @@ def generate_random_string(length=16):
     return ''.join(random.choices(chars, k=length))
 
 
-def extract_composers_urls():
-    composers = requests.get(config.Crawl.base_url + config.Crawl.composers_url)
-    soup = BeautifulSoup(composers.text, 'html.parser')
+def parse_composers(html):
+    # only the blockquotes are made into a tree, the rest of the page is skipped
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('blockquote'))
 
     blockquote = soup.find_all(name='blockquote')
     blockquote = blockquote[1]
@@ -71,15 +605,13 @@ def extract_composers_urls():
     return composers_dict
 
 
-def extract_composer_tracks(composer_page_url):
-    page = requests.get(composer_page_url)
-
-    page_soup = BeautifulSoup(page.text, 'html.parser')
-
-    pattern = r'^https://www\.midiworld\.com/.+\.mid$'
+def parse_composer_tracks(html):
+    pattern = r'^' + re.escape(config.Crawl.base_url) + r'.+\.mid$'
     pattern = re.compile(pattern)
 
-    p = page_soup.find_all('a', href=pattern)
+    # only the links to midi files are made into a tree
+    page_soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('a', href=pattern))
+    p = page_soup.find_all('a')
 
     tracks = []
     for i in p:
@@ -90,67 +622,192 @@ def extract_composer_tracks(composer_page_url):
     return tracks
 
 
-def read_db(path=config.MidiFiles.database):
-    if not os.path.exists(path) or os.path.getsize(path) == 0:
-        headers = ['Composer', 'Name', 'FileName', 'Url']
+def extract_composers_urls():
+    composers = requests.get(config.Crawl.base_url + config.Crawl.composers_url)
+    composers.raise_for_status()
+    return parse_composers(composers.text)
 
-        df = pd.DataFrame(columns=headers)
-        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
-        df.to_csv(path, index=False)
 
-    db = pd.read_csv(path)
+def extract_composer_tracks(composer_page_url):
+    page = requests.get(composer_page_url)
+    page.raise_for_status()
+    return parse_composer_tracks(page.text)
+
+
+def known_download_info(row):
+    return row['Url'], config.MidiFiles.raw_midi_files / row['FileName'], row
+
+
+def track_download_info(composer_name, track_name, track_url):
+    filename = f'{composer_name}_{track_name}_{generate_random_string(5)}.mid'
+    filename = re.sub(r'[\/\\:*?"<>|\n\r\t]', '_', filename)
+
+    row = {
+        'Composer': composer_name,
+        'Name': track_name,
+        'FileName': filename, 
+        'Url': track_url
+    }
+
+    return track_url, config.MidiFiles.raw_midi_files / filename, row
+
+
+async def crawl_composers(composers_dict=None, callback=None, known={}, revalidate=config.Crawl.revalidate, screen=None, page_conn=config.Crawl.page_conn, max_conn=config.Crawl.max_conn, progress=True, page_cache=None, revalidate_unchanged=config.Crawl.revalidate_unchanged):
+    """
+        The whole crawl as one pipeline over one session: composer pages are fetched and
+        parsed by page_conn workers while max_conn workers download the tracks found so
+        far, so the download slots don't drain between composers. The download queue is
+        bounded, the pages are only read a few files ahead of the downloads.
+        The composers are read from the composers page if they aren't given. known maps
+        the urls we already have to their rows, they are skipped or with revalidate only
+        downloaded again if they changed. Files are screened by screen (see download)
+        before they are stored. callback(row) is called after each file that was downloaded,
+        with its validators, checksum and the reason it was rejected if it was.
+        With a page_cache (see fetch_page) the index pages are only parsed if they changed,
+        and of a composer whose page didn't change only the tracks we don't know yet are
+        downloaded, the rest are not revalidated unless revalidate_unchanged is set.
+        Downloads are written to disk behind the event loop by one WriteBehind, how long
+        the loop was blocked anyway is reported at the end.
+        Returns the ConnectionStats and DownloadStats of the crawl.
+    """
+    stats = ConnectionStats()
+    download_stats = DownloadStats()
+    page_stats = PageStats()
+    seen = set()
+
+    pages = asyncio.Queue()
+    downloads = asyncio.Queue(maxsize=max_conn * 4)
+    limiter = AdaptiveLimiter(max_limit=max_conn)
+    callback_lock = asyncio.Lock()
+    pg = tqdm(total=0, desc='Downloading MIDI Files', disable=not progress)
+    writer = WriteBehind()
+
+    async with create_session(stats) as session, LoopMonitor() as monitor:
+        async def page_worker():
+            while True:
+                composer_name, link = await pages.get()
+                try:
+                    tracks, changed = await with_retries(lambda: fetch_page(session, config.Crawl.base_url + link, parse_composer_tracks, page_cache, page_stats), limiter)
+
+                    if not changed and not revalidate_unchanged:
+                        tracks = [(track_name, track_url) for track_name, track_url in tracks if track_url not in known]
+                        if not tracks:
+                            page_stats.skipped += 1
+
+                    for track_name, track_url in tracks:
+                        if track_url in seen:
+                            continue
+                        seen.add(track_url)
+
+                        # Check if we already have downloaded the file
+                        if track_url in known:
+                            if not revalidate:
+                                continue
+                            info = known_download_info(known[track_url])
+                        else:
+                            info = track_download_info(composer_name, track_name, track_url)
+
+                        pg.total += 1
+                        pg.refresh()
+                        await downloads.put(info)
+                except Exception as e:
+                    tqdm.write(f'Composer {composer_name} had some error: {e}')
+                finally:
+                    pages.task_done()
+
+        async def download_worker():
+            while True:
+                url, path, row = await downloads.get()
+                try:
+                    exists = await writer.run(path.exists)
+                    validators = (row.get('ETag'), row.get('LastModified'))
+
+                    if exists and not any(validators) and not row.get('Rejected'):
+                        # known from before validators were stored, or from a server without them:
+                        # the file is kept as it is and only its validators are fetched for next time
+                        etag, last_modified = await with_retries(lambda: fetch_validators(session, url), limiter)
+                        result = DownloadResult(False, False, etag, last_modified, row.get('Sha256'), row.get('Size'))
+                    else:
+                        # a rejected file is only screened again if it changed
+                        etag, last_modified = validators if exists or row.get('Rejected') else (None, None)
+                        result = await with_retries(lambda: download(session, url, path, etag, last_modified, download_stats, screen, writer), limiter)
+
+                    download_stats.add(result)
+
+                    if (result.modified or (result.etag, result.last_modified) != validators) and callback:
+                        row = dict(row, ETag=result.etag, LastModified=result.last_modified, Sha256=result.sha256, Size=result.size, Rejected=result.rejected)
+                        async with callback_lock:
+                            await callback(row)
+                except Exception as e:
+                    download_stats.failed += 1
+                    tqdm.write(f'File {url} had some error: {e}')
+                finally:
+                    pg.update(1)
+                    downloads.task_done()
+
+        workers = [asyncio.create_task(page_worker()) for _ in range(page_conn)]
+        workers += [asyncio.create_task(download_worker()) for _ in range(max_conn)]
+
+        try:
+            # inside the try, so the writer and the progress bar are closed if it fails
+            if composers_dict is None:
+                composers_url = config.Crawl.base_url + config.Crawl.composers_url
+                composers_dict, changed = await with_retries(lambda: fetch_page(session, composers_url, parse_composers, page_cache, page_stats), limiter)
+
+            for composer in composers_dict.items():
+                pages.put_nowait(composer)
+
+            await pages.join()
+            await downloads.join()
+        finally:
+            for t in workers:
+                t.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await asyncio.to_thread(writer.shutdown)
+            pg.close()
+            tqdm.write(f'Pages: {page_stats}')
+            tqdm.write(f'Concurrency: {limiter}')
+            tqdm.write(f'Disk writes: {writer}')
+            tqdm.write(f'Event loop: {monitor}')
+
+    return stats, download_stats
+
+
+def read_db(path=config.MidiFiles.database, csv_path=config.MidiFiles.database_export):
+    """
+        Opens the download database, a new one starts from the rows of the csv export
+        if there is one.
+    """
+    new = not os.path.exists(path)
+    db = DownloadDB(path)
+
+    if new and os.path.exists(csv_path) and os.path.getsize(csv_path) != 0:
+        db.import_csv(csv_path)
+
     return db
 
 
-def download_composers_midi(composers_dict, no_redownload=True):
+def download_composers_midi(composers_dict=None, no_redownload=True):
     db = read_db()
     pathlib.Path(config.MidiFiles.raw_midi_files).mkdir(parents=True, exist_ok=True)
    
     async def _download_callback(row):
-        nonlocal db
-        db = pd.concat([db, pd.DataFrame([row])], ignore_index=True)
+        db.add(row)
+
+    known = db.rows() if no_redownload else {}
+    screen = functools.partial(screen_midi, merge=config.Crawl.merge_tracks) if config.Crawl.screen else None
 
     try:
-        for composer_name, link in composers_dict.items():
-            print(f'Download {composer_name} Files')
-
-            download_info = []
-            composer_tracks = extract_composer_tracks(config.Crawl.base_url + link)
-
-            for track in composer_tracks:
-                track_name, track_url = track
-
-                filename = f'{composer_name}_{track_name}_{generate_random_string(5)}.mid'
-                filename = re.sub(r'[\/\\:*?"<>|\n\r\t]', '_', filename)
-                
-                # Check if we already have downloaded the file
-                if no_redownload and track_url in db['Url'].values:
-                    continue
-
-                row = {
-                    'Composer': composer_name,
-                    'Name': track_name,
-                    'FileName': filename, 
-                    'Url': track_url
-                }
-
-                download_info.append((track_url, config.MidiFiles.raw_midi_files / filename, row))
-
-            asyncio.run(
-                batch_download(
-                    download_info,
-                    _download_callback, 
-                    progress_settings={'desc': 'Downloading MIDI Files'}
-                )
-            )
-            db.to_csv(config.MidiFiles.database, index=False)
+        stats, download_stats = asyncio.run(crawl_composers(composers_dict, _download_callback, known, screen=screen, page_cache=db))
+        print('Downloads:', download_stats)
+        print('Connections:', stats)
     finally:
-        db.to_csv(config.MidiFiles.database, index=False)
+        db.export_csv(config.MidiFiles.database_export)
+        db.close()
         print('Saved the progress!')
 
 def main():
-    composers = extract_composers_urls()
-    download_composers_midi(composers)
+    download_composers_midi()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
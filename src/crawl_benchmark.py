@@ -0,0 +1,158 @@
+import config, asyncio, json, tempfile, time, aiohttp, numpy as np
+from datetime import datetime
+from pathlib import Path
+from src import crawl
+from src.mock_server import MockServer
+
+
+def summarize(latencies, seconds, size):
+    """
+        Throughput and per-file latency percentiles of files that took latencies seconds
+        each, size bytes in total, over a run of `seconds`.
+    """
+    return {
+        "files": len(latencies),
+        "seconds": round(seconds, 6),
+        "files_per_sec": len(latencies) / seconds,
+        "mb_per_sec": size / 2**20 / seconds,
+        "p50": float(np.percentile(latencies, 50)) if latencies else None,
+        "p99": float(np.percentile(latencies, 99)) if latencies else None,
+    }
+
+
+async def time_blocking(func, args_list):
+    """
+        Calls the blocking func(*args) of every args in a thread, one after the other
+        like the crawler does, returns the latency of every call.
+    """
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        await asyncio.to_thread(func, *args)
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+async def time_downloads(info, limiter, max_conn):
+    """
+        Runs batch_download on info with the limiter, returns the latency of every file
+        from the start of its first request to the end of its callback.
+    """
+    starts = {}
+    latencies = []
+
+    async def on_request_start(session, context, params):
+        starts.setdefault(str(params.url), time.perf_counter())
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+
+    async def callback(url):
+        latencies.append(time.perf_counter() - starts[url])
+
+    async with crawl.create_session(trace_configs=[trace_config]) as session:
+        await crawl.batch_download(info, callback, max_conn, progress=False, session=session, limiter=limiter)
+
+    return latencies
+
+
+async def run(concurrency=config.CrawlBenchmark.concurrency):
+    """
+        Crawls a mock server made from config.CrawlBenchmark: the composers page and the
+        composer pages with the blocking extractors, and every file with batch_download
+        at each fixed concurrency and with the adaptive limiter. The blocking extractors
+        have no retries, they are timed without the server's failures.
+    """
+    results = {}
+
+    server = MockServer(
+        composers=config.CrawlBenchmark.composers,
+        files_per_composer=config.CrawlBenchmark.files_per_composer,
+        notes=config.CrawlBenchmark.notes,
+        latency=config.CrawlBenchmark.latency,
+        bandwidth=config.CrawlBenchmark.bandwidth,
+        failure_rate=config.CrawlBenchmark.failure_rate,
+        retry_after=0,
+    )
+
+    base_url = config.Crawl.base_url
+    partial_downloads = config.MidiFiles.partial_downloads
+
+    try:
+        async with server:
+            config.Crawl.base_url = server.base_url
+            server.failure_rate = 0
+
+            start = time.perf_counter()
+            latencies = await time_blocking(crawl.extract_composers_urls, [()] * 5)
+            results["extract_composers_urls"] = summarize(latencies, time.perf_counter() - start, 0)
+
+            # the server runs on this loop, the blocking calls can't be made from it
+            composers = await asyncio.to_thread(crawl.extract_composers_urls)
+            start = time.perf_counter()
+            latencies = await time_blocking(crawl.extract_composer_tracks, [(server.base_url + link,) for link in composers.values()])
+            results["extract_composer_tracks"] = summarize(latencies, time.perf_counter() - start, 0)
+
+            tracks = []
+            for link in composers.values():
+                tracks += [url for name, url in await asyncio.to_thread(crawl.extract_composer_tracks, server.base_url + link)]
+
+            server.failure_rate = config.CrawlBenchmark.failure_rate
+
+            runs = {f"batch_download/{level}": (level, crawl.AdaptiveLimiter(level, level, level)) for level in concurrency}
+            runs["batch_download/adaptive"] = (config.Crawl.max_conn, crawl.AdaptiveLimiter())
+
+            for name, (max_conn, limiter) in runs.items():
+                with tempfile.TemporaryDirectory() as root:
+                    config.MidiFiles.partial_downloads = Path(root) / "partial"
+                    info = [(url, Path(root) / f"{i}.mid", url) for i, url in enumerate(tracks)]
+
+                    start = time.perf_counter()
+                    latencies = await time_downloads(info, limiter, max_conn)
+                    seconds = time.perf_counter() - start
+
+                    # only the files that made it count, not the ones that failed for good
+                    size = sum(path.stat().st_size for url, path, _ in info if path.exists())
+                    results[name] = summarize(latencies, seconds, size)
+                    results[name]["failed"] = len(info) - len(latencies)
+                    results[name]["limit"] = limiter.limit
+    finally:
+        config.Crawl.base_url = base_url
+        config.MidiFiles.partial_downloads = partial_downloads
+
+    return results
+
+
+def settings():
+    return {
+        "composers": config.CrawlBenchmark.composers,
+        "files_per_composer": config.CrawlBenchmark.files_per_composer,
+        "notes": config.CrawlBenchmark.notes,
+        "latency": config.CrawlBenchmark.latency,
+        "bandwidth": config.CrawlBenchmark.bandwidth,
+        "failure_rate": config.CrawlBenchmark.failure_rate,
+    }
+
+
+def report(results):
+    print(f"{'run':<32}{'files/sec':>12}{'MB/sec':>10}{'p50 ms':>10}{'p99 ms':>10}{'failed':>8}")
+    for name, metrics in results.items():
+        failed = metrics.get("failed", "-")
+        print(f"{name:<32}{metrics['files_per_sec']:>12.1f}{metrics['mb_per_sec']:>10.2f}{metrics['p50'] * 1000:>10.1f}{metrics['p99'] * 1000:>10.1f}{failed:>8}")
+
+
+def main():
+    results = asyncio.run(run())
+    report(results)
+
+    Path(config.MidiFiles.log_space).mkdir(parents=True, exist_ok=True)
+    path = config.MidiFiles.log_space / f"crawl_benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(path, "w") as f:
+        json.dump({"settings": settings(), "results": results}, f, indent=2)
+
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
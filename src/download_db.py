@@ -0,0 +1,132 @@
+import config, json, sqlite3, pandas as pd
+from pathlib import Path
+
+# csv header: (table column, type)
+COLUMNS = {
+    'Composer': ('composer', 'TEXT'),
+    'Name': ('name', 'TEXT'),
+    'FileName': ('file_name', 'TEXT'),
+    'Url': ('url', 'TEXT PRIMARY KEY'),
+    'ETag': ('etag', 'TEXT'),
+    'LastModified': ('last_modified', 'TEXT'),
+    'Sha256': ('sha256', 'TEXT'),
+    'Size': ('size', 'INTEGER'),
+    'Rejected': ('rejected', 'TEXT'),
+}
+
+# the index pages that were crawled, with what was parsed from them as json
+PAGE_COLUMNS = "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, sha256 TEXT, links TEXT"
+
+
+class DownloadDB:
+    """
+        The downloaded files in an sqlite database indexed by url. Rows are added in
+        batches of batch_size per transaction, the journal is write-ahead so a crash
+        loses at most the batch that wasn't committed yet, never the database.
+        The old db.csv is imported the first time and is only an export afterwards.
+        The composer and track index pages are cached in it too, see page and add_page.
+    """
+    def __init__(self, path=config.MidiFiles.database, batch_size=config.Crawl.db_batch_size):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.pending = 0
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (" + ', '.join(f"{column} {kind}" for column, kind in COLUMNS.values()) + ")"
+        )
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS pages ({PAGE_COLUMNS})")
+
+        # databases made before a column was added
+        existing = {info[1] for info in self.connection.execute("PRAGMA table_info(files)")}
+        for column, kind in COLUMNS.values():
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE files ADD COLUMN {column} {kind}")
+
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, url):
+        return self.connection.execute("SELECT 1 FROM files WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def urls(self):
+        return {url for url, in self.connection.execute("SELECT url FROM files")}
+
+    def rows(self):
+        """
+            {url: row} of every file, the rows have the csv headers as keys.
+        """
+        df = self.to_dataframe()
+        df = df.astype(object).where(df.notna(), None)
+
+        return {row['Url']: row for row in df.to_dict('records')}
+
+    def add(self, row):
+        """
+            Adds a row with the csv headers as keys, a known url is replaced. Composer,
+            Name, FileName and Url are needed, the rest are None if missing.
+        """
+        columns = ', '.join(column for column, kind in COLUMNS.values())
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO files ({columns}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [row.get(header) for header in COLUMNS],
+        )
+
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def page(self, url):
+        """
+            (etag, last_modified, sha256, links) of the cached index page at url, None
+            if it was never crawled.
+        """
+        row = self.connection.execute("SELECT etag, last_modified, sha256, links FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+
+        etag, last_modified, sha256, links = row
+        return etag, last_modified, sha256, json.loads(links)
+
+    def add_page(self, url, etag, last_modified, sha256, links):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages (url, etag, last_modified, sha256, links) VALUES (?, ?, ?, ?, ?)",
+            (url, etag, last_modified, sha256, json.dumps(links)),
+        )
+
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def to_dataframe(self):
+        columns = ', '.join(f"{column} AS {header}" for header, (column, kind) in COLUMNS.items())
+        return pd.read_sql_query(f"SELECT {columns} FROM files ORDER BY rowid", self.connection)
+
+    def export_csv(self, path=config.MidiFiles.database_export):
+        self.commit()
+        self.to_dataframe().to_csv(path, index=False)
+
+    def import_csv(self, path=config.MidiFiles.database_export):
+        for row in pd.read_csv(path, dtype={'Composer': str, 'Name': str, 'FileName': str, 'Url': str}, keep_default_na=False).to_dict('records'):
+            self.add({header: value if value != '' else None for header, value in row.items()})
+
+        self.commit()
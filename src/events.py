@@ -0,0 +1,186 @@
+import numpy as np
+
+# columns of an event array
+TICK, TYPE, PITCH, VELOCITY, TEMPO, DURATION = range(6)
+NUM_COLUMNS = 5
+
+# event types
+NOTE_ON, NOTE_OFF, SET_TEMPO = range(3)
+
+EVENT_COLUMNS = ("tick", "type", "pitch", "velocity", "tempo")
+NOTE_COLUMNS = EVENT_COLUMNS + ("duration",)
+FINAL_COLUMNS = ("delta_time", "pitch", "duration")
+FINAL_HEADER = ','.join(FINAL_COLUMNS)
+
+EVENT_DTYPE = np.int32
+
+
+def empty_events(length=0):
+    return np.zeros((length, NUM_COLUMNS), dtype=EVENT_DTYPE)
+
+
+def from_midi_track(track, ticks_per_beat):
+    """
+        Walks a (merged) mido track and returns (events, ticks_per_beat), only notes and
+        tempo changes are kept, everything else is metadata for us.
+    """
+    ticks = []
+    types = []
+    pitches = []
+    velocities = []
+    tempos = []
+
+    tick = 0
+    for msg in track:
+        tick += msg.time
+
+        if msg.type == 'note_on' or msg.type == 'note_off':
+            ticks.append(tick)
+            types.append(NOTE_ON if msg.type == 'note_on' else NOTE_OFF)
+            pitches.append(msg.note)
+            velocities.append(msg.velocity)
+            tempos.append(0)
+
+        elif msg.type == 'set_tempo':
+            ticks.append(tick)
+            types.append(SET_TEMPO)
+            pitches.append(0)
+            velocities.append(0)
+            tempos.append(msg.tempo)
+
+    events = empty_events(len(ticks))
+    events[:, TICK] = ticks
+    events[:, TYPE] = types
+    events[:, PITCH] = pitches
+    events[:, VELOCITY] = velocities
+    events[:, TEMPO] = tempos
+
+    return events, ticks_per_beat
+
+
+def preprocess_notes(events):
+    events = events.copy()
+
+    note_offs = events[:, TYPE] == NOTE_OFF
+    events[note_offs, TYPE] = NOTE_ON
+    events[note_offs, VELOCITY] = 0
+
+    return events
+
+
+def scale_ticks(ticks, tempo_ticks, tempos, ticks_per_beat, t_new=380, s_new=500000):
+    """
+        Converts absolute ticks to ticks at t_new ticks per beat and s_new tempo.
+        tempos[i] starts at tempo_ticks[i], before the first change the tempo is 500000.
+        Every tick is converted from its absolute time on the tempo map, so rounding
+        doesn't build up along the piece.
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    tempo_ticks = np.concatenate([[0], np.asarray(tempo_ticks, dtype=np.int64)])
+    tempos = np.concatenate([[500_000], np.asarray(tempos, dtype=np.int64)])
+
+    # microseconds (times ticks_per_beat) at the start of every tempo segment
+    segment_starts = np.concatenate([[0], np.cumsum(np.diff(tempo_ticks) * tempos[:-1])])
+
+    segments = np.searchsorted(tempo_ticks, ticks, side='right') - 1
+    times = segment_starts[segments] + (ticks - tempo_ticks[segments]) * tempos[segments]
+
+    return np.rint(times * (t_new / (s_new * ticks_per_beat))).astype(np.int64)
+
+
+def scale_timings(events, ticks_per_beat, t_new=380, s_new=500000):
+    """
+        Same conversion as Preprocess.scale_timings, tempo events are dropped.
+    """
+    is_tempo = events[:, TYPE] == SET_TEMPO
+    tempo_changes = events[is_tempo]
+
+    events = events[~is_tempo].copy()
+    events[:, TICK] = scale_ticks(events[:, TICK], tempo_changes[:, TICK], tempo_changes[:, TEMPO], ticks_per_beat, t_new, s_new)
+
+    return events
+
+
+def match_note_offs(ticks, pitches, velocities):
+    """
+        Pairs every note-on with the next zero velocity note-on of the same pitch in
+        one pass over the notes sorted by pitch, returns the durations (0 for the
+        note-offs and for notes that never go off).
+        A pitch that is struck again while still sounding is not cut, all of its open
+        strikes last until the next note-off of that pitch, like the old rescanning.
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    pitches = np.asarray(pitches, dtype=np.int64)
+    velocities = np.asarray(velocities, dtype=np.int64)
+
+    count = len(ticks)
+    positions = np.arange(count)
+
+    order = np.lexsort((positions, pitches))
+    sorted_pitches = pitches[order]
+    sorted_ticks = ticks[order]
+
+    # position of the first note-off at or after every position, in pitch order
+    next_off = np.where(velocities[order] == 0, positions, count)
+    next_off = np.minimum.accumulate(next_off[::-1])[::-1]
+
+    found = next_off < count
+    found[found] = sorted_pitches[next_off[found]] == sorted_pitches[found]
+
+    sorted_durations = np.zeros(count, dtype=np.int64)
+    sorted_durations[found] = sorted_ticks[next_off[found]] - sorted_ticks[found]
+
+    durations = np.empty(count, dtype=np.int64)
+    durations[order] = sorted_durations
+    durations[velocities == 0] = 0
+
+    return durations
+
+
+def calculate_note_durations(events):
+    """
+        Returns the note-ons with a non zero velocity and their duration in an extra
+        DURATION column.
+    """
+    notes = events[events[:, TYPE] == NOTE_ON]
+    is_on = notes[:, VELOCITY] != 0
+
+    durations = match_note_offs(notes[:, TICK], notes[:, PITCH], notes[:, VELOCITY])
+
+    return np.column_stack([notes[is_on], durations[is_on].astype(notes.dtype)])
+
+
+def calculate_delta_times(ticks):
+    return np.diff(ticks, prepend=0)
+
+
+def finalize(notes):
+    """
+        Builds the final (delta_time, pitch, duration) array.
+    """
+    delta_times = calculate_delta_times(notes[:, TICK])
+
+    return np.column_stack([delta_times, notes[:, PITCH], notes[:, DURATION]])
+
+
+def to_csv_lines(final):
+    res = [FINAL_HEADER + '\n']
+    res.extend(f"{d},{p},{t}\n" for d, p, t in final.tolist())
+
+    return res
+
+
+def dump(path, data):
+    """
+        Writes the arrays of a stage as csv, for debugging.
+    """
+    if isinstance(data, tuple):
+        data = data[0]
+
+    columns = {
+        len(EVENT_COLUMNS): EVENT_COLUMNS,
+        len(NOTE_COLUMNS): NOTE_COLUMNS,
+        len(FINAL_COLUMNS): FINAL_COLUMNS,
+    }[data.shape[1]]
+
+    np.savetxt(path, data, fmt="%d", delimiter=',', header=','.join(columns), comments='')
@@ -0,0 +1,91 @@
+import config, io, threading, numpy as np, pandas as pd
+from collections import OrderedDict
+from src.cache import ArrayCache, content_key
+from src import features, events as ev
+
+
+class FeatureStore:
+    """
+        The model-ready features (see features.encode) of pieces, by the content of their
+        source and the version of the features: the last used ones are kept in memory up
+        to memory_bytes, over an ArrayCache on disk that keeps all of them. Safe to use
+        from the threads of a tf.data map.
+    """
+    def __init__(self, path=config.MidiFiles.cache_space / "features", memory_bytes=config.LstmParameters.feature_memory_bytes):
+        self.disk = ArrayCache(path)
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def params(self, source):
+        return {"features": features.VERSION, "source": source}
+
+    def piece(self, events):
+        """
+            The features of a piece of (delta_time, pitch, duration) events, like a piece
+            of the packed corpus.
+        """
+        events = np.ascontiguousarray(events)
+        key = content_key(events.tobytes(), self.params(f"events {events.dtype.str} {events.shape}"))
+
+        return self.get(key, lambda: features.encode(events))
+
+    def csv(self, path):
+        """
+            The features of a preprocessed csv file, it is only parsed if it changed since
+            its features were made.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        def encode():
+            df = pd.read_csv(io.BytesIO(data), usecols=list(ev.FINAL_COLUMNS))
+            return features.encode(df[list(ev.FINAL_COLUMNS)].to_numpy())
+
+        return self.get(content_key(data, self.params("csv")), encode)
+
+    def get(self, key, encode):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+
+        result = self.disk.get(key)
+        if result is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            try:
+                result = encode()
+            except Exception as e:
+                self.disk.put_error(key, e)
+                raise
+
+            self.disk.put(key, result)
+
+        self.remember(key, result)
+
+        return result
+
+    def remember(self, key, result):
+        result.flags.writeable = False # shared by everyone who gets it
+
+        with self.lock:
+            if key in self.memory:
+                return
+
+            self.memory[key] = result
+            self.memory_used += result.nbytes
+
+            while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+                key, evicted = self.memory.popitem(last=False)
+                self.memory_used -= evicted.nbytes
+
+    def __str__(self):
+        return f"{self.memory_hits} memory hits, {self.disk_hits} disk hits, {self.misses} encoded, {self.memory_used / 2**20:.1f} MB in memory"
@@ -0,0 +1,73 @@
+import numpy as np
+from src import events as ev
+
+# the feature store keeps the features of every version apart, bump it when encode changes
+VERSION = 1
+
+NOTES = 12
+OCTAVES = 10
+
+# columns of a model-ready event: the log1p times, the flags and the one-hots
+DELTA_TIME = 0
+DURATION = 1
+ZERO_DELTA_TIME = 2
+EOF = 3
+NOTE = slice(4, 4 + NOTES)
+OCTAVE = slice(NOTE.stop, NOTE.stop + OCTAVES)
+NUM_FEATURES = OCTAVE.stop # config.LstmParameters.num_features
+
+# the columns every output head of the model predicts
+HEADS = {
+    'out_delta': slice(DELTA_TIME, DELTA_TIME + 1),
+    'out_duration': slice(DURATION, DURATION + 1),
+    'out_zero_delta': slice(ZERO_DELTA_TIME, ZERO_DELTA_TIME + 1),
+    'out_eof': slice(EOF, EOF + 1),
+    'out_note': NOTE,
+    'out_octave': OCTAVE,
+}
+
+PITCH = ev.FINAL_COLUMNS.index("pitch")
+
+
+def forward_fill_zeros(values):
+    """
+        Every 0 replaced by the last value before it that wasn't 0, the leading ones stay 0.
+    """
+    last = np.where(values != 0, np.arange(len(values)), 0)
+    np.maximum.accumulate(last, out=last)
+
+    return values[last]
+
+
+def encode(piece, eof=True):
+    """
+        The (N, NUM_FEATURES) float32 model input of a piece of (delta_time, pitch, duration)
+        events, what the training notebook made with pandas: log1p times, the delta times of
+        chords replaced by the last one with the zero_delta_time flag set, the EOF flag on
+        the last event (if eof), and the pitch one-hot as note and octave. Octaves past the
+        last one are clamped to it.
+    """
+    piece = np.asarray(piece)
+    delta_time = np.log1p(piece[:, ev.FINAL_COLUMNS.index("delta_time")].astype(np.float32))
+    duration = np.log1p(piece[:, ev.FINAL_COLUMNS.index("duration")].astype(np.float32))
+    pitch = piece[:, PITCH].astype(np.int64)
+
+    features = np.zeros((len(piece), NUM_FEATURES), dtype=np.float32)
+    features[:, DELTA_TIME] = forward_fill_zeros(delta_time)
+    features[:, DURATION] = duration
+    features[:, ZERO_DELTA_TIME] = delta_time == 0
+    if eof and len(piece):
+        features[-1, EOF] = 1
+
+    rows = np.arange(len(piece))
+    features[rows, NOTE.start + pitch % NOTES] = 1
+    features[rows, OCTAVE.start + np.minimum(pitch // NOTES, OCTAVES - 1)] = 1
+
+    return features
+
+
+def targets(y):
+    """
+        {head: its columns of y}, the training targets of the next events y.
+    """
+    return {name: y[..., columns] for name, columns in HEADS.items()}
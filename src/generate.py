@@ -1,4 +1,6 @@
-from src.lstm import get_model
+from src.lstm import get_model, get_step_model, zero_states
+from src import corpus, features
+from src.feature_store import FeatureStore
 import config, os, random, pandas as pd, numpy as np, tqdm, pathlib
 import tensorflow as tf
 
@@ -17,101 +19,134 @@ def load_model():
     return model
 
 
-def preprocess_file(df):
-    df['delta_time'] = np.log1p(df['delta_time'])
-    df['duration'] = np.log1p(df['duration'])
-
-    df['note'] = df['pitch'] % 12
-    df['octave'] = df['pitch'] // 12
-
-    df['zero_delta_time'] = df['delta_time'] == 0
-    df["delta_time"] = df["delta_time"].replace(0, pd.NA).ffill()
-    df["delta_time"] = df["delta_time"].fillna(0)
-
-    df = df.drop(columns=["pitch"])
-
-    return df
-
-
-def load_seeds(files=[], k=10):
+def load_seeds(files=[], k=10, store=None):
     """
-        Loads k random seeds from csv files, or trys to load given files as seeds
+        Loads k random seeds from the packed corpus (or the csv files if there is no
+        corpus yet), or trys to load given files as seeds. Their features come from the
+        FeatureStore, a new one unless it is given.
     """
-    seeds = []
-    file_names = []
     csv_files_path = config.MidiFiles.preprocessed_csv_files
+    seq_len = config.LstmParameters.seq_len
+
+    if store is None:
+        store = FeatureStore()
+
+    packed = None
+    if corpus.exists():
+        packed = corpus.Corpus()
 
     if len(files) != 0:
-        pass
+        names = files
+    elif packed is not None:
+        names = random.sample(packed.names, k)
     else:
-        file_names = os.listdir(csv_files_path)
-        file_names = random.sample(file_names, k)
-        
-    for p in file_names:
+        names = random.sample(os.listdir(csv_files_path), k)
+
+    for p in names:
         try:
-            pd.set_option("future.no_silent_downcasting", True)
-            df = pd.read_csv(csv_files_path / p)
-            df = preprocess_file(df)
-            seeds.append(df)
+            if packed is not None:
+                piece_features = store.piece(packed.piece(p))
+            else:
+                piece_features = store.csv(csv_files_path / p)
         except Exception as e:
             print("Skipping", p, e)
+            continue
+
+        yield (p, piece_features[0:seq_len])
+
+
+def sample_step(pred_delta, pred_duration, pred_zero_delta, pred_eof, pred_note, pred_octave):
+    """
+        The next event of every row from the six heads: the predictions as they are, and
+        the note and octave sampled from their softmax distributions.
+    """
+    note_index = tf.random.categorical(tf.math.log(pred_note), 1)[:, 0]
+    note_onehot = tf.one_hot(note_index, depth=features.NOTES)
 
-    for name, df in zip(file_names, seeds):
-        copied_df = df.copy()
-            
-        # one-hot encoding the notes
-        notes = copied_df["note"].astype(int).values
-        notes_onehot = np.eye(12, dtype=np.float32)[notes]  # shape (len, 12)
+    octave_index = tf.random.categorical(tf.math.log(pred_octave), 1)[:, 0]
+    octave_onehot = tf.one_hot(octave_index, depth=features.OCTAVES)
 
-        # one-hot encoding the octave
-        octaves = copied_df["octave"].astype(int).values
-        octaves_onehot = np.eye(10, dtype=np.float32)[octaves]  # shape (len, 10)
+    # Concatenate all outputs into one step vector, in the order of features.encode
+    return tf.concat([
+        tf.cast(pred_delta, tf.float32),       # (batch, 1)
+        tf.cast(pred_duration, tf.float32),    # (batch, 1)
+        tf.cast(pred_zero_delta, tf.float32),   # (batch, 1)
+        tf.cast(pred_eof, tf.float32),   # (batch, 1)
+        note_onehot, # (batch, 12)
+        octave_onehot, # (batch, 10)
+    ], axis=-1)  # shape (batch, 26)
 
-        # drop old note column and replace with one-hot
-        copied_df = copied_df.drop(columns=["note", "octave"])
-        data = np.hstack([copied_df.values.astype(np.float32), notes_onehot, octaves_onehot])
 
-        # split features
-        X_seq = data[:, :]  # all features
-        seq_len = config.LstmParameters.seq_len
+def step_function(step_model):
+    return tf.function(step_model, reduce_retracing=True)
 
-        yield (name, X_seq[0:seq_len])
 
+def prime(step, seeds):
+    """
+        The outputs of the step function after every seed from zero states, the seeds of
+        the same length are run together.
+    """
+    by_length = {}
+    for i, seed in enumerate(seeds):
+        by_length.setdefault(len(seed), []).append(i)
 
-def generate(model, seed_sequence, steps=150):
-    seed_sequence = tf.expand_dims(seed_sequence, 0)
-    generated_sequence = tf.identity(seed_sequence)
-    sequence_length = seed_sequence.shape[1]
+    order = []
+    parts = []
+    for indices in by_length.values():
+        order += indices
+        batch = tf.constant(np.stack([seeds[i] for i in indices]), dtype=tf.float32)
+        parts.append(step([batch] + zero_states(len(indices))))
 
-    for _ in tqdm.tqdm(range(steps)):
-        input_seq = generated_sequence[:, -sequence_length:, :]
+    inverse = np.argsort(order)
+    return [tf.gather(tf.concat([part[j] for part in parts], axis=0), inverse) for j in range(len(parts[0]))]
 
-        pred_delta, pred_duration, pred_zero_delta, pred_note, pred_octave = model(input_seq)
 
-        # Optionally sample instead of taking raw predictions
-        # For categorical note output: sample from softmax distribution
-        note_probs = tf.squeeze(pred_note)  # shape (12,)
-        note_index = tf.random.categorical(tf.math.log([note_probs]), 1)
-        note_onehot = tf.one_hot(tf.squeeze(note_index), depth=12)
+def generate_batch(step, seeds, steps=150, eof_threshold=config.LstmParameters.eof_threshold):
+    """
+        Continues all of the seeds at once, by up to steps events each, with the step
+        function of a step model (see lstm.get_step_model): the LSTM states of the seeds
+        are computed once, and every new event of every seed is one timestep of one
+        batch. The note and octave of every row are sampled on their own. A sequence is
+        finished by the first event whose EOF is over eof_threshold, the others go on
+        until they all are or steps is reached. Returns the events of every seed, the
+        seed and what was generated for it until it finished.
+    """
+    outputs = prime(step, seeds)
+
+    lengths = np.full(len(seeds), steps)
+    finished = np.zeros(len(seeds), dtype=bool)
+    generated = []
+    for i in tqdm.tqdm(range(steps)):
+        heads, states = outputs[:6], outputs[6:]
 
-        octave_probs = tf.squeeze(pred_octave)  # shape (10,)
-        octave_index = tf.random.categorical(tf.math.log([octave_probs]), 1)
-        octave_onehot = tf.one_hot(tf.squeeze(octave_index), depth=10)
+        next_step = sample_step(*heads)
+        generated.append(next_step)
 
-        # Concatenate all outputs into one step vector
-        next_step = tf.concat([
-            tf.cast(pred_delta, tf.float32),       # (batch, 1)
-            tf.cast(pred_duration, tf.float32),    # (batch, 1)
-            tf.cast(pred_zero_delta, tf.float32),   # (batch, 1)
-            tf.cast(tf.expand_dims(note_onehot, axis=0), tf.float32), # Add batch dimension
-            tf.cast(tf.expand_dims(octave_onehot, axis=0), tf.float32) # Add batch dimension
-        ], axis=-1)  # shape (batch, 25) - 1 (pitch) + 12 (note onehot) + 10 (octave onehot) = 25
+        eof = heads[3][:, 0].numpy() > eof_threshold
+        lengths[eof & ~finished] = i + 1
+        finished |= eof
+        if finished.all():
+            break
 
-        generated_sequence = tf.concat(
-            [generated_sequence, next_step[:, tf.newaxis, :]], axis=1
-        )
+        outputs = step([next_step[:, tf.newaxis, :]] + states)
+
+    if generated:
+        generated = tf.stack(generated, axis=1).numpy() # (seeds, generated events, num_features)
+    else: # steps was 0
+        generated = np.zeros((len(seeds), 0, features.NUM_FEATURES), dtype=np.float32)
+
+    return [np.concatenate([seed, generated[row, :lengths[row]]]) for row, seed in enumerate(seeds)]
+
+
+def generate(model, seed_sequence, steps=150, step_model=None):
+    """
+        Continues one seed, see generate_batch. The step model is made from the model
+        unless it is given.
+    """
+    if step_model is None:
+        step_model = get_step_model(model)
 
-    return generated_sequence
+    return generate_batch(step_function(step_model), [seed_sequence], steps)[0]
 
 
 def reverse_preprocess_file(df):
@@ -133,14 +168,14 @@ def reverse_preprocess_file(df):
     return df
 
 
-def trun_back_to_df(generated_sequence, start=0):
-    seq = generated_sequence[0].numpy()
+def trun_back_to_df(sequence, start=0):
+    seq = np.asarray(sequence)
 
-    delta_time = seq[start:, 0]
-    duration = seq[start:, 1]
-    zero_delta_time = seq[start:, 2]
-    note_onehot = seq[start:, 3:15] 
-    octave = seq[start:, 15:25]
+    delta_time = seq[start:, features.DELTA_TIME]
+    duration = seq[start:, features.DURATION]
+    zero_delta_time = seq[start:, features.ZERO_DELTA_TIME]
+    note_onehot = seq[start:, features.NOTE]
+    octave = seq[start:, features.OCTAVE]
 
     note = np.argmax(note_onehot, axis=1)
     octave = np.argmax(octave, axis=1)
@@ -183,26 +218,20 @@ def save_csv(df, file_name, remove_pervious_generated_csvs=False):
     df.to_csv(save_path / file_name, index=False)
 
 
-def main(k=3, steps=150, include_seed_in_result=False):
-    start = 50
-    if include_seed_in_result:
-        start = 0
-    
+def main(k=3, steps=150, include_seed_in_result=False, batch_size=config.LstmParameters.generation_batch_size):
     model = load_model()
-    seeds = load_seeds(k=k)
+    step = step_function(get_step_model(model))
+    seeds = list(load_seeds(k=int(k)))
 
-    generated_csvs = []
-    names = []
-    for name, seed in seeds:
-        print(f"Generating seed: {name}")
-        seq = generate(model, seed, steps)
+    for i in range(0, len(seeds), batch_size):
+        batch = seeds[i:i + batch_size]
+        print(f"Generating seeds {i + 1}-{i + len(batch)} of {len(seeds)}")
 
-        csv = trun_back_to_df(seq, start)
-        generated_csvs.append(csv)
-        names.append(name)
-        save_csv(csv, name)
+        sequences = generate_batch(step, [seed for name, seed in batch], steps)
+        for (name, seed), seq in zip(batch, sequences):
+            start = 0 if include_seed_in_result else len(seed)
+            save_csv(trun_back_to_df(seq, start), name)
 
-    # save_csvs(generated_csvs, names)
     print("Done!")
 
 
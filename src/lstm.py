@@ -3,17 +3,10 @@ from tensorflow.keras.layers import GRU, Input, Embedding, LSTM, Dense, Concaten
 from tensorflow.keras.models import Model
 import config
 
-def get_model():
-    seq_len = config.LstmParameters.seq_len
-    num_features = config.LstmParameters.num_features
-    inputs = Input(shape=(seq_len, num_features))
+LSTM_UNITS = (512, 512, 512)
 
-    x = LSTM(512, return_sequences=True)(inputs)
-
-    x = LSTM(512, return_sequences=True)(x)
-
-    x = LSTM(512, return_sequences=False)(x)
 
+def heads(x):
     x = LayerNormalization()(x)
 
     x = Dense(256, activation='relu')(x)
@@ -27,7 +20,21 @@ def get_model():
     out_note = Dense(12, activation='softmax', name='out_note')(x)
     out_octave = Dense(10, activation='softmax', name='out_octave')(x)
 
-    model = Model(inputs=inputs, outputs=[out_delta, out_duration,  out_zero_delta, out_eof, out_note, out_octave])
+    return [out_delta, out_duration,  out_zero_delta, out_eof, out_note, out_octave]
+
+
+def get_model():
+    seq_len = config.LstmParameters.seq_len
+    num_features = config.LstmParameters.num_features
+    inputs = Input(shape=(seq_len, num_features))
+
+    x = LSTM(LSTM_UNITS[0], return_sequences=True)(inputs)
+
+    x = LSTM(LSTM_UNITS[1], return_sequences=True)(x)
+
+    x = LSTM(LSTM_UNITS[2], return_sequences=False)(x)
+
+    model = Model(inputs=inputs, outputs=heads(x))
 
     model.compile(
         optimizer='adam',
@@ -49,4 +56,38 @@ def get_model():
         }
     )
 
-    return model
\ No newline at end of file
+    return model
+
+
+def get_step_model(model=None):
+    """
+        The model of get_model run a few events at a time: it takes
+        [events (batch, steps, num_features), h and c of every LSTM layer] and returns the
+        six heads after the last event and the new h and c of every layer, so each event
+        is only run through the LSTMs once. With a model its weights are used.
+        Run on a seed from zero states it gives what the model gives on that window.
+    """
+    num_features = config.LstmParameters.num_features
+    inputs = Input(shape=(None, num_features))
+    states = [Input(shape=(units,)) for units in LSTM_UNITS for _ in ('h', 'c')]
+
+    x = inputs
+    new_states = []
+    for i, units in enumerate(LSTM_UNITS):
+        last = i == len(LSTM_UNITS) - 1
+        x, h, c = LSTM(units, return_sequences=not last, return_state=True)(x, initial_state=states[2 * i:2 * i + 2])
+        new_states += [h, c]
+
+    step_model = Model(inputs=[inputs] + states, outputs=heads(x) + new_states)
+
+    if model is not None:
+        layers = [layer for layer in model.layers if layer.weights]
+        step_layers = [layer for layer in step_model.layers if layer.weights]
+        for layer, step_layer in zip(layers, step_layers, strict=True):
+            step_layer.set_weights(layer.get_weights())
+
+    return step_model
+
+
+def zero_states(batch_size=1):
+    return [tf.zeros((batch_size, units)) for units in LSTM_UNITS for _ in ('h', 'c')]
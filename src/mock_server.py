@@ -0,0 +1,192 @@
+import asyncio, hashlib, io, random
+from email.utils import formatdate
+from aiohttp import web
+from src.benchmark import synthetic_midi
+
+
+class MockServer:
+    """
+        Local stand-in for the midi site to test and measure the crawler against: a
+        composers page, a page per composer and synthetic midi files, a non_piano_rate
+        of them for other instruments. Files have an ETag and Last-Modified and answer
+        HEAD, conditional and Range requests, sent at most at bandwidth bytes per second
+        each, and the pages have an ETag of their content.
+        Every request waits a random latency in the (low, high) seconds, and fails with
+        failure_rate, half of the failures are 503s with a Retry-After of retry_after
+        seconds and the rest 500s.
+        Point config.Crawl.base_url to base_url to crawl it.
+    """
+    def __init__(self, composers=4, files_per_composer=25, non_piano_rate=0.0, latency=(0, 0), failure_rate=0.0,
+                 retry_after=1, notes=200, bandwidth=None, seed=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+
+        self.base_url = None
+        self.runner = None
+
+        self.requests = 0
+        self.failures = 0
+        self.not_modified = 0
+        self.partial = 0
+        self.heads = 0
+        self.bytes_sent = 0
+
+        self.composers = {f"Composer {i}": [f"composer{i}_{j}.mid" for j in range(files_per_composer)] for i in range(composers)}
+        self.files = {}
+        for names in self.composers.values():
+            for name in names:
+                program = self.rng.randint(8, 127) if self.rng.random() < non_piano_rate else self.rng.randint(0, 7)
+                mid = synthetic_midi(self.rng, notes, tempo_changes=4, program=program)
+
+                buffer = io.BytesIO()
+                mid.save(file=buffer)
+                self.update_file(name, buffer.getvalue())
+
+    def update_file(self, name, body):
+        """
+            Replaces the content of a file, it gets a new ETag and Last-Modified.
+        """
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        self.files[name] = (body, etag, formatdate(usegmt=True))
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/composers.htm', self.composers_page)
+        app.router.add_get('/composer{index}.htm', self.composer_page)
+        app.router.add_get('/midi/{name}', self.midi_file)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+
+        self.port = self.runner.addresses[0][1]
+        self.base_url = f"http://{self.host}:{self.port}/"
+
+        return self.base_url
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def inject(self):
+        """
+            Waits the latency of a request, returns the failure response if it fails.
+        """
+        self.requests += 1
+        low, high = self.latency
+        if high > 0:
+            await asyncio.sleep(self.rng.uniform(low, high))
+
+        if self.rng.random() < self.failure_rate:
+            self.failures += 1
+            if self.rng.random() < 0.5:
+                return web.Response(status=503, headers={'Retry-After': str(self.retry_after)})
+            return web.Response(status=500)
+
+        return None
+
+    async def send(self, request, body, status=200, headers={}):
+        """
+            Sends a file body, throttled to the bandwidth if there is one.
+        """
+        self.bytes_sent += len(body)
+        if not self.bandwidth:
+            return web.Response(status=status, body=body, headers=headers)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(body)
+        await response.prepare(request)
+
+        chunk_size = 16 * 1024
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            await response.write(chunk)
+            await asyncio.sleep(len(chunk) / self.bandwidth)
+
+        await response.write_eof()
+        return response
+
+    def page(self, request, html):
+        """
+            An index page with an ETag of its content, 304 if the client has it.
+        """
+        etag = '"' + hashlib.sha1(html.encode()).hexdigest()[:16] + '"'
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+
+        return web.Response(text=html, content_type='text/html', headers={'ETag': etag})
+
+    async def composers_page(self, request):
+        failure = await self.inject()
+        if failure:
+            return failure
+
+        links = ''.join(f'<a href="composer{i}.htm">{name}:</a>\n' for i, name in enumerate(self.composers))
+        return self.page(request, f"<html><blockquote>Composers</blockquote><blockquote>{links}</blockquote></html>")
+
+    async def composer_page(self, request):
+        failure = await self.inject()
+        if failure:
+            return failure
+
+        names = list(self.composers.values())[int(request.match_info['index'])]
+        links = ''.join(f'<a href="{self.base_url}midi/{name}">{name[:-4]}</a>\n' for name in names)
+        return self.page(request, f"<html>{links}</html>")
+
+    async def midi_file(self, request):
+        failure = await self.inject()
+        if failure:
+            return failure
+
+        if request.match_info['name'] not in self.files:
+            raise web.HTTPNotFound()
+
+        body, etag, last_modified = self.files[request.match_info['name']]
+        headers = {'ETag': etag, 'Last-Modified': last_modified, 'Accept-Ranges': 'bytes'}
+
+        if request.headers.get('If-None-Match') == etag or (
+            'If-None-Match' not in request.headers and request.headers.get('If-Modified-Since') == last_modified
+        ):
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+
+        if request.method == 'HEAD':
+            self.heads += 1
+            return web.Response(headers=headers)
+
+        byte_range = request.headers.get('Range', '')
+        if_range = request.headers.get('If-Range')
+        if byte_range.startswith('bytes=') and byte_range.endswith('-') and if_range in (None, etag, last_modified):
+            start = int(byte_range[len('bytes='):-1])
+            if start >= len(body):
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{len(body)}'})
+
+            self.partial += 1
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+            return await self.send(request, body[start:], 206, headers)
+
+        return await self.send(request, body, headers=headers)
+
+
+async def serve(**kwargs):
+    async with MockServer(**kwargs) as server:
+        print(f"Serving {len(server.files)} files on {server.base_url}")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
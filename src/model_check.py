@@ -0,0 +1,112 @@
+import config, numpy as np
+import tensorflow as tf
+from src.lstm import get_model, get_step_model, zero_states
+from src.train import make_dataset
+from src.generate import generate_batch, step_function
+from src import features
+
+# largest difference allowed between the windowed and the step model
+TOLERANCE = 1e-4
+
+
+def random_piece(rng, length):
+    """
+        The features of a random piece of (delta_time, pitch, duration) events.
+    """
+    events = np.column_stack([
+        rng.integers(0, 3, length) * rng.integers(0, 400, length),
+        rng.integers(21, 109, length),
+        rng.integers(1, 1000, length),
+    ])
+
+    return features.encode(events)
+
+
+def check_step_model(model, step_model, rng, windows=4):
+    """
+        The step model primed from zero states on a window gives what the windowed model
+        gives, and so it does when the last event of the window is run as a step of its own.
+    """
+    seq_len = config.LstmParameters.seq_len
+    x = tf.constant(np.stack([random_piece(rng, seq_len) for _ in range(windows)]))
+
+    expected = model(x, training=False)
+
+    primed = step_model([x] + zero_states(windows), training=False)
+    before = step_model([x[:, :-1]] + zero_states(windows), training=False)
+    stepped = step_model([x[:, -1:]] + list(before[6:]), training=False)
+
+    errors = {}
+    for name, want, got, got_stepped in zip(features.HEADS, expected, primed[:6], stepped[:6]):
+        errors[name] = float(max(np.abs(want - got).max(), np.abs(want - got_stepped).max()))
+
+    return all(error <= TOLERANCE for error in errors.values()), errors
+
+
+def check_training(model, rng, pieces=6):
+    """
+        A batch of the training pipeline, transposed, trains the model to a finite loss.
+    """
+    seq_len = config.LstmParameters.seq_len
+    data = [random_piece(rng, int(length)) for length in rng.integers(seq_len + 1, 3 * seq_len, pieces)]
+    data.append(random_piece(rng, seq_len // 2)) # too short for a window
+
+    dataset = make_dataset(np.arange(len(data)), lambda i: data[i], augment=True, batch_size=16, shuffle_buffer=64)
+    x, y = next(iter(dataset.take(1)))
+
+    shapes = x.shape[1:] == (seq_len, features.NUM_FEATURES) and all(
+        y[name].shape[1:] == (columns.stop - columns.start,) for name, columns in features.HEADS.items()
+    )
+    loss = np.asarray(model.train_on_batch(x, y))
+
+    return bool(shapes and np.isfinite(loss).all()), {"batch": tuple(x.shape), "loss": loss.tolist()}
+
+
+def check_generation(step_model, rng, steps=5):
+    """
+        A batch of seeds of different lengths is continued, every sequence starts with
+        its seed and has at most steps new events.
+    """
+    seq_len = config.LstmParameters.seq_len
+    seeds = [random_piece(rng, seq_len), random_piece(rng, seq_len), random_piece(rng, seq_len // 2)]
+
+    sequences = generate_batch(step_function(step_model), seeds, steps)
+
+    ok = len(sequences) == len(seeds) and all(
+        sequence.shape[1] == features.NUM_FEATURES
+        and len(seed) < len(sequence) <= len(seed) + steps
+        and np.allclose(sequence[:len(seed)], seed)
+        for seed, sequence in zip(seeds, sequences)
+    )
+
+    return ok, {"lengths": [len(sequence) for sequence in sequences]}
+
+
+def main(seed=0):
+    rng = np.random.default_rng(seed)
+    tf.random.set_seed(seed)
+
+    model = get_model()
+    step_model = get_step_model(model)
+
+    checks = {
+        "step_model": lambda: check_step_model(model, step_model, rng),
+        "generate_batch": lambda: check_generation(step_model, rng),
+        "training": lambda: check_training(model, rng),
+    }
+
+    failed = []
+    for name, check in checks.items():
+        ok, details = check()
+        print(f"{name:<16}{'ok' if ok else 'FAILED':<8}{details}")
+        if not ok:
+            failed.append(name)
+
+    if failed:
+        raise SystemExit(f"Model checks failed: {', '.join(failed)}")
+
+    print("All model checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+import config, os, random, pickle, shutil, tqdm, time, json, heapq, resource, numpy as np
+from collections import namedtuple
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from src.cache import ArrayCache, content_key
+
+Record = namedtuple("Record", ["name", "data"])
+
+
+def peak_rss():
+    """
+        Peak resident set size of this process so far, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def count_events(data):
+    """
+        Number of events in the data of a record: rows of an event array, lines of a
+        csv file or messages of a midi file. Raw bytes and anything else count as 0.
+    """
+    if isinstance(data, tuple):
+        data = data[0]
+
+    if isinstance(data, (list, np.ndarray)):
+        return len(data)
+
+    if hasattr(data, "tracks"):
+        return sum(len(track) for track in data.tracks)
+
+    return 0
+
+
+class StageReport:
+    """
+        What a stage did in a run: the error logs and the metrics of the run manifest.
+        The reports of the workers are merged into one, the slowest files are kept
+        in a heap of (seconds, name) of at most `slowest` files.
+    """
+    def __init__(self, slowest=0):
+        self.logs = []
+        self.failed = {}
+        self.files = 0
+        self.seconds = 0.0
+        self.events = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.slowest = slowest
+        self.slowest_files = []
+
+    def add_error(self, name, error):
+        self.logs.append(f"File {name} had some error: {error}")
+        self.failed[name] = str(error)
+
+    def add_file(self, name, seconds):
+        self.files += 1
+        self.seconds += seconds
+        self.peak_rss = max(self.peak_rss, peak_rss())
+
+        if self.slowest > 0:
+            heapq.heappush(self.slowest_files, (seconds, name))
+            if len(self.slowest_files) > self.slowest:
+                heapq.heappop(self.slowest_files)
+
+    def merge(self, other):
+        self.logs.extend(other.logs)
+        self.failed.update(other.failed)
+        self.files += other.files
+        self.seconds += other.seconds
+        self.events += other.events
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+
+        for item in other.slowest_files:
+            heapq.heappush(self.slowest_files, item)
+            if len(self.slowest_files) > self.slowest:
+                heapq.heappop(self.slowest_files)
+
+    def to_dict(self):
+        """
+            The manifest entry of the stage. seconds is the time spent in the stage
+            summed over every file (and worker), so the rates are per worker. A cached
+            stage has its cache hits and misses too.
+        """
+        entry = {
+            "files": self.files,
+            "errors": len(self.failed),
+            "seconds": round(self.seconds, 6),
+            "files_per_sec": self.files / self.seconds if self.seconds else None,
+            "events": self.events,
+            "events_per_sec": self.events / self.seconds if self.seconds else None,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_kb": self.peak_rss,
+            "failed": self.failed,
+            "slowest": [{"file": name, "seconds": round(seconds, 6)} for seconds, name in sorted(self.slowest_files, reverse=True)],
+        }
+
+        if self.cache_hits or self.cache_misses:
+            entry["cache_hits"] = self.cache_hits
+            entry["cache_misses"] = self.cache_misses
+
+        return entry
+
+
+class Stage:
+    """
+        One per-file step of a pipeline, func(data, **kwargs) returns the new data of
+        a record. Calling a stage on records lazily yields the new records, files that
+        raise are logged and dropped. rename(name) gives the name of the new record,
+        with pass_name func is called as func(name, data, **kwargs).
+        With reads the data of the records are paths whose size is counted as read,
+        with writes func returns the number of bytes it wrote.
+    """
+    def __init__(self, name, func, rename=None, pass_name=False, reads=False, writes=False, **kwargs):
+        self.name = name
+        self.func = func
+        self.rename = rename
+        self.pass_name = pass_name
+        self.reads = reads
+        self.writes = writes
+        self.kwargs = kwargs
+
+    def report_names(self):
+        return [self.name]
+
+    def run(self, records, reports):
+        return self(records, reports[self.name])
+
+    def __call__(self, records, report):
+        for record in records:
+            start = time.perf_counter()
+            try:
+                if self.reads:
+                    report.bytes_read += os.path.getsize(record.data)
+
+                if self.pass_name:
+                    data = self.func(record.name, record.data, **self.kwargs)
+                else:
+                    data = self.func(record.data, **self.kwargs)
+            except Exception as e:
+                report.add_error(record.name, e)
+                continue
+            finally:
+                report.add_file(record.name, time.perf_counter() - start)
+
+            if self.writes:
+                report.bytes_written += data
+            else:
+                report.events += count_events(data)
+
+            name = record.name
+            if self.rename:
+                name = self.rename(name)
+
+            yield Record(name, data)
+
+
+def run_cached(name, data, stages, cache_path, params, reports, report):
+    """
+        The result of the stages on data from the cache, or of running them. On a miss
+        every stage is timed into its own report of reports, a hit or miss is counted
+        in report.
+    """
+    cache = ArrayCache(cache_path)
+    key = content_key(data, params)
+
+    try:
+        result = cache.get(key)
+    except ValueError:
+        report.cache_hits += 1
+        raise
+
+    if result is not None:
+        report.cache_hits += 1
+        return result
+
+    report.cache_misses += 1
+    for stage in stages:
+        stage_report = reports[stage.name]
+        start = time.perf_counter()
+        try:
+            data = stage.func(data, **stage.kwargs)
+        except Exception as e:
+            stage_report.add_error(name, e)
+            cache.put_error(key, e)
+            raise
+        finally:
+            stage_report.add_file(name, time.perf_counter() - start)
+
+        stage_report.events += count_events(data)
+
+    cache.put(key, data)
+
+    return data
+
+
+class CachedStage(Stage):
+    """
+        Runs a chain of stages as one stage whose results (and errors) are cached by
+        the content of the input bytes and params, so unchanged files skip the chain.
+        The stages of the chain are reported on their own for the files they ran on,
+        the cached stage for every file with its cache hits and misses.
+    """
+    def __init__(self, name, stages, cache_path, params, rename=None):
+        super().__init__(name, run_cached, rename=rename, pass_name=True, stages=stages, cache_path=cache_path, params=params)
+
+    def report_names(self):
+        return [self.name] + [stage.name for stage in self.kwargs["stages"]]
+
+    def run(self, records, reports):
+        stage_reports = {stage.name: reports[stage.name] for stage in self.kwargs["stages"]}
+        stage = Stage(self.name, self.func, rename=self.rename, pass_name=True, reports=stage_reports, report=reports[self.name], **self.kwargs)
+
+        return stage(records, reports[self.name])
+
+
+class Checkpoint:
+    """
+        Policy for a stage boundary: every record is written to the stage's directory
+        with write(path, data) as it passes, and read(path) loads it back so a later
+        run can pick up from there. Without read it is only a dump for debugging.
+    """
+    def __init__(self, write, read=None):
+        self.write = write
+        self.read = read
+
+    def __call__(self, records, path, report):
+        for record in records:
+            start = time.perf_counter()
+            self.write(path / record.name, record.data)
+            report.seconds += time.perf_counter() - start
+            report.bytes_written += os.path.getsize(path / record.name)
+
+            yield record
+
+
+class Pipeline:
+    """
+        A chain of stages, checkpoints maps stage names to (Checkpoint, directory).
+        read(data) loads the records before the first stage, it is reported as a stage
+        named "read". The reports keep the `slowest` files of every stage.
+    """
+    def __init__(self, stages, checkpoints={}, read=None, slowest=0):
+        self.stages = stages
+        self.checkpoints = checkpoints
+        self.read = read
+        self.slowest = slowest
+
+    def stream(self, records, reports):
+        if self.read:
+            records = Stage("read", self.read, reads=True)(records, reports["read"])
+
+        for stage in self.stages:
+            records = stage.run(records, reports)
+
+            if stage.name in self.checkpoints:
+                checkpoint, path = self.checkpoints[stage.name]
+                records = checkpoint(records, path, reports[stage.name])
+
+        return records
+
+    def new_reports(self):
+        names = [name for stage in self.stages for name in stage.report_names()]
+        if self.read:
+            names.insert(0, "read")
+
+        return {name: StageReport(self.slowest) for name in names}
+
+    def _process(self, record, keep_results=True):
+        reports = self.new_reports()
+        results = [(r.name, r.data if keep_results else None) for r in self.stream([record], reports)]
+
+        return results, reports
+
+    def run(self, records, workers=1, desc=None, keep_results=True):
+        """
+            Streams the records through every stage, in a process pool if there is more
+            than one worker. Returns ({name: data} of the last stage, {stage: StageReport}),
+            in the order of the records whatever the number of workers. Without keep_results
+            the data isn't kept (or sent back from the workers), only the names.
+        """
+        reports = self.new_reports()
+        results = {}
+
+        if workers <= 1:
+            for record in self.stream(tqdm.tqdm(records, desc=desc), reports):
+                results[record.name] = record.data if keep_results else None
+        else:
+            chunksize = max(1, len(records) // (workers * 8))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                outputs = executor.map(self._process, records, [keep_results] * len(records), chunksize=chunksize)
+
+                for record_results, record_reports in tqdm.tqdm(outputs, total=len(records), desc=desc):
+                    results.update(record_results)
+                    for name, report in record_reports.items():
+                        reports[name].merge(report)
+
+        return results, reports
+
+
+def read_lines(path):
+    with open(path, 'r') as f:
+        return f.readlines()
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_if_changed(path, text):
+    """
+        Writes text to path unless the file already has it, returns the number of bytes
+        written (0 if it was left alone).
+    """
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            if f.read() == text:
+                return 0
+
+    with open(path, 'w') as f:
+        f.write(text)
+
+    return os.path.getsize(path)
+
+
+LINES = Checkpoint(write_lines, read_lines)
+BYTES = Checkpoint(write_bytes, read_bytes)
+
+
+class PipelineRunner:
+    """
+        Runs a list of stages over a directory of files and keeps the progress of the
+        checkpointed stages in temp space, so the run can be picked up later.
+    """
+    def __init__(self, try_to_load_progress=True):
+        Path(config.MidiFiles.temp_space).mkdir(parents=True, exist_ok=True)
+        self.try_to_load_progress = try_to_load_progress
+
+        if try_to_load_progress and self.load_progress():
+            pass
+        else:
+            self.preprocess_id = f"{self.__class__.__name__}_{self.generate_random_string(6)}"
+            self.temp_space = config.MidiFiles.temp_space / self.preprocess_id
+            self.progress = {}
+
+    def generate_random_string(self, length=16):
+        chars = [chr(i) for i in range(97,123)]
+        chars = ''.join(chars)
+        chars += chars.upper()
+
+        random_string = [random.choice(chars) for i in range(length)]
+
+        return ''.join(random_string)
+
+    def run_stages(self, stages, source, read, checkpoints={}, pick_up_from=None, workers=None, desc=None, keep_results=True, slowest=None):
+        """
+            Runs the stages on the files of the source directory, read(path) loads a file.
+            The stages are picked up after the latest checkpoint in the progress that comes
+            before pick_up_from (a stage name or index), or from the source if there is none.
+            A manifest of the run with the metrics of every stage (and its `slowest` files)
+            is written to the log space. Returns the results of the last stage like Pipeline.run.
+        """
+        if workers is None:
+            workers = config.PreprocessParameters.workers
+
+        if slowest is None:
+            slowest = config.PreprocessParameters.slowest_files
+
+        names = [stage.name for stage in stages]
+
+        end = len(stages)
+        if pick_up_from is not None:
+            end = names.index(pick_up_from) if pick_up_from in names else int(pick_up_from)
+
+        start = 0
+        files_path = source
+        for index in reversed(range(end)):
+            name = names[index]
+            checkpoint = checkpoints.get(name)
+
+            if checkpoint and checkpoint.read and name in self.progress and (self.temp_space / self.progress[name]).exists():
+                print(f"Loaded {name} progress!")
+                start = index + 1
+                files_path = self.temp_space / self.progress[name]
+                read = checkpoint.read
+                break
+
+        stages = stages[start:]
+        if len(stages) == 0:
+            return {}, {}
+
+        report_names = ["read"] + [name for stage in stages for name in stage.report_names()]
+        func_ids = {name: f"{name}_{self.generate_random_string(6)}" for name in report_names}
+
+        pipeline_checkpoints = {}
+        for name, checkpoint in checkpoints.items():
+            if name in func_ids:
+                path = self.temp_space / func_ids[name]
+                os.makedirs(path)
+                pipeline_checkpoints[name] = (checkpoint, path)
+
+        records = [Record(f, files_path / f) for f in sorted(os.listdir(files_path))]
+
+        started = datetime.now()
+        start = time.perf_counter()
+        results, reports = Pipeline(stages, pipeline_checkpoints, read, slowest).run(records, workers, desc, keep_results)
+        wall_time = time.perf_counter() - start
+
+        Path(config.MidiFiles.log_space).mkdir(parents=True, exist_ok=True)
+        for name, report in reports.items():
+            with open(config.MidiFiles.log_space / func_ids[name], 'w') as file:
+                file.writelines([i + '\n' for i in report.logs])
+
+        print("Exceptions:", sum(len(report.logs) for report in reports.values()))
+
+        self.write_manifest(reports, func_ids, files_path, len(records), len(results), workers, started, wall_time)
+
+        for name, (checkpoint, path) in pipeline_checkpoints.items():
+            if checkpoint.read:
+                self.progress[name] = func_ids[name]
+
+        return results, reports
+
+    def write_manifest(self, reports, func_ids, source, files_in, files_out, workers, started, wall_time):
+        """
+            Writes the json manifest of a run to the log space, the stages are in the order
+            they ran and point to their error logs.
+        """
+        manifest = {
+            "pipeline": self.__class__.__name__,
+            "progress_id": self.preprocess_id,
+            "started": started.isoformat(timespec="seconds"),
+            "source": str(source),
+            "workers": workers,
+            "files_in": files_in,
+            "files_out": files_out,
+            "wall_time": round(wall_time, 6),
+            "files_per_sec": files_in / wall_time if wall_time else None,
+            "peak_rss_kb": max(peak_rss(), resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+            "stages": [dict(stage=name, log=func_ids[name], **report.to_dict()) for name, report in reports.items()],
+        }
+
+        path = config.MidiFiles.log_space / f"manifest_{self.__class__.__name__}_{started:%Y%m%d_%H%M%S}_{self.generate_random_string(6)}.json"
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        return path
+
+    def save_progress(self, clear_cache=True):
+        Path(self.temp_space).mkdir(parents=True, exist_ok=True)
+        file_path = self.preprocess_id + '.pkl'
+
+        with open(self.temp_space / file_path, "wb") as file:
+            pickle.dump(self.progress, file)
+
+        if clear_cache:
+            values = self.progress.values()
+            directories = [d for d in os.listdir(self.temp_space) if os.path.isdir(os.path.join(self.temp_space, d))]
+            for directory in directories:
+                if directory not in values:
+                    shutil.rmtree(self.temp_space / directory)
+
+    def load_progress(self):
+        progresses = os.listdir(config.MidiFiles.temp_space)
+        filtered = [
+            f for f in progresses
+            if f.startswith(self.__class__.__name__) and (config.MidiFiles.temp_space / f / f"{f}.pkl").exists()
+        ]
+
+        pkl_file = ""
+        progress = ""
+
+        if len(filtered) == 0:
+            return False
+
+        elif len(filtered) == 1:
+            progress = filtered[0]
+            pkl_file = config.MidiFiles.temp_space / progress / f"{progress}.pkl"
+
+        else:
+            [print(f"{i}. {progress}") for i, progress in enumerate(filtered)]
+            option = int(input())
+
+            progress = filtered[option]
+            pkl_file = config.MidiFiles.temp_space / progress / f"{progress}.pkl"
+
+
+        with open(pkl_file, "rb") as file:
+            self.progress = pickle.load(file)
+            self.preprocess_id = progress
+            self.temp_space = config.MidiFiles.temp_space / self.preprocess_id
+
+        print(f"Loaded progress {progress}")
+
+        return True
@@ -0,0 +1,157 @@
+import os, struct
+from collections import namedtuple
+from pathlib import Path
+
+DEFAULT_TEMPO = 500000
+
+# data bytes after the status byte of the channel messages, by their high nibble
+CHANNEL_DATA_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+# and of the system common / realtime messages
+SYSTEM_DATA_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+PROGRAM_CHANGE = 0xC0
+META = 0xFF
+SET_TEMPO = 0x51
+
+SmfInfo = namedtuple("SmfInfo", ["format", "ticks_per_beat", "tracks", "events", "programs", "tempo_map", "ticks", "seconds"])
+
+
+def read_varlen(data, i):
+    value = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, i
+
+
+def scan_track(data, i, end, programs, tempos):
+    """
+        Walks the events of the track in data[i:end] like mido's reader does (running
+        status is kept through sysex but not meta events), adds its program changes to
+        programs and its (tick, tempo) changes to tempos. Returns (events, ticks).
+    """
+    events = 0
+    tick = 0
+    last_status = None
+
+    while i < end:
+        delta, i = read_varlen(data, i)
+        tick += delta
+        events += 1
+
+        status = data[i]
+        if status < 0x80:
+            if last_status is None:
+                raise ValueError("Running status without last status")
+            status = last_status
+        else:
+            i += 1
+            if status != META:
+                last_status = status
+
+        if status == META:
+            kind = data[i]
+            length, i = read_varlen(data, i + 1)
+            if kind == SET_TEMPO and length == 3:
+                tempos.append((tick, (data[i] << 16) | (data[i + 1] << 8) | data[i + 2]))
+            i += length
+
+        elif status == 0xF0 or status == 0xF7:
+            length, i = read_varlen(data, i)
+            i += length
+
+        elif status < 0xF0:
+            if status & 0xF0 == PROGRAM_CHANGE:
+                programs.add(data[i])
+            i += CHANNEL_DATA_LENGTHS[status & 0xF0]
+
+        elif status in SYSTEM_DATA_LENGTHS:
+            i += SYSTEM_DATA_LENGTHS[status]
+
+        else:
+            raise ValueError(f"Undefined status byte 0x{status:02x}")
+
+    if i > end:
+        raise ValueError("Track ended in the middle of an event")
+
+    return events, tick
+
+
+def ticks_to_seconds(ticks, tempo_map, ticks_per_beat):
+    seconds = 0.0
+    last_tick, tempo = 0, DEFAULT_TEMPO
+
+    for tick, new_tempo in tempo_map:
+        if tick >= ticks:
+            break
+        seconds += (tick - last_tick) * tempo / (ticks_per_beat * 1e6)
+        last_tick, tempo = tick, new_tempo
+
+    return seconds + (ticks - last_tick) * tempo / (ticks_per_beat * 1e6)
+
+
+def scan(data):
+    """
+        Reads the program changes, tempo map and stats of a standard midi file straight
+        from its bytes, without making a message object, and returns an SmfInfo. events
+        counts the events of every track, ticks is the length of the longest track and
+        seconds its duration on the tempo map (None for SMPTE timing). Raises ValueError
+        for anything mido couldn't read either.
+    """
+    if len(data) < 14 or data[:4] != b'MThd':
+        raise ValueError("MThd not found. Probably not a MIDI file")
+
+    header_size = struct.unpack_from('>L', data, 4)[0]
+    if header_size < 6:
+        raise ValueError("MIDI file header is too short")
+    smf_format, track_count, division = struct.unpack_from('>hhh', data, 8)
+
+    programs = set()
+    tempos = []
+    events = 0
+    ticks = 0
+
+    i = 8 + header_size
+    try:
+        for _ in range(track_count):
+            if data[i:i + 4] != b'MTrk':
+                raise ValueError("No MTrk header at start of track")
+
+            size = struct.unpack_from('>L', data, i + 4)[0]
+            i += 8
+            track_events, track_ticks = scan_track(data, i, i + size, programs, tempos)
+            i += size
+
+            events += track_events
+            ticks = max(ticks, track_ticks)
+    except (IndexError, KeyError, struct.error) as e:
+        raise ValueError(f"Truncated or corrupt MIDI file: {e!r}")
+
+    tempo_map = tuple(sorted(tempos, key=lambda change: change[0]))
+    seconds = ticks_to_seconds(ticks, tempo_map, division) if division > 0 else None
+
+    return SmfInfo(smf_format, division, track_count, events, frozenset(programs), tempo_map, ticks, seconds)
+
+
+def scan_file(path):
+    with open(path, 'rb') as f:
+        return scan(f.read())
+
+
+def index(directory):
+    """
+        Scans every file of a directory, returns {name: SmfInfo}, and {name: error} for
+        the ones that couldn't be read.
+    """
+    infos = {}
+    errors = {}
+
+    for name in sorted(os.listdir(directory)):
+        try:
+            infos[name] = scan_file(Path(directory) / name)
+        except (OSError, ValueError) as e:
+            errors[name] = str(e)
+
+    return infos, errors
@@ -0,0 +1,170 @@
+import config, os, re, numpy as np
+import tensorflow as tf
+from pathlib import Path
+from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
+from src.lstm import get_model
+from src import corpus, features
+from src.feature_store import FeatureStore
+
+CHECKPOINT_PATTERN = re.compile(r"lstm-(\d+)-([\d.]+)\.weights\.h5")
+
+
+def piece_source(store):
+    """
+        (names, load) of the pieces to train on, load(i) gets the features of piece i from
+        the FeatureStore when it is needed: of a view into the memory-mapped corpus if
+        there is one, or else of its csv file.
+    """
+    if corpus.exists():
+        packed = corpus.Corpus()
+        return packed.names, lambda i: store.piece(packed.piece(int(i)))
+
+    csv_files_path = Path(config.MidiFiles.preprocessed_csv_files)
+    names = sorted(os.listdir(csv_files_path))
+
+    return names, lambda i: store.csv(csv_files_path / names[i])
+
+
+def split_pieces(count, validation_split=config.LstmParameters.validation_split, seed=config.LstmParameters.seed):
+    """
+        Random (train, validation) indices of count pieces, the windows of a piece are
+        all on the same side.
+    """
+    order = np.random.default_rng(seed).permutation(count)
+    validation_size = int(count * validation_split)
+
+    return order[validation_size:], order[:validation_size]
+
+
+def transpose(x, y, transpose_offset=config.LstmParameters.transpose_offset):
+    """
+        Transposes every window of a batch and its target by its own random number of
+        semitones, one of the transpose_offset around 0, and makes their note and octave
+        one-hots again from the shifted pitches like encode does. A window that would go
+        out of the octaves is kept as it is.
+    """
+    def pitch(note, octave):
+        return tf.argmax(octave, axis=-1, output_type=tf.int32) * features.NOTES + tf.argmax(note, axis=-1, output_type=tf.int32)
+
+    def one_hots(pitch):
+        return tf.one_hot(pitch % features.NOTES, features.NOTES), tf.one_hot(pitch // features.NOTES, features.OCTAVES)
+
+    pitches = pitch(x[..., features.NOTE], x[..., features.OCTAVE]) # (batch, seq_len)
+    target = pitch(y['out_note'], y['out_octave']) # (batch,)
+
+    shift = tf.random.uniform(tf.shape(target), -(transpose_offset // 2), transpose_offset - transpose_offset // 2, dtype=tf.int32)
+    low = tf.minimum(tf.reduce_min(pitches, axis=1), target)
+    high = tf.maximum(tf.reduce_max(pitches, axis=1), target)
+    shift = tf.where((low + shift >= 0) & (high + shift < features.NOTES * features.OCTAVES), shift, 0)
+
+    note, octave = one_hots(pitches + shift[:, tf.newaxis])
+    x = tf.concat([x[..., :features.NOTE.start], note, octave], axis=-1)
+
+    note, octave = one_hots(target + shift)
+    return x, dict(y, out_note=note, out_octave=octave)
+
+
+def make_dataset(indices, load, shuffle=True, augment=False, seq_len=config.LstmParameters.seq_len,
+                 batch_size=config.LstmParameters.batch_size, shuffle_buffer=config.LstmParameters.shuffle_buffer,
+                 cycle_length=config.LstmParameters.cycle_length, transpose_offset=config.LstmParameters.transpose_offset,
+                 seed=config.LstmParameters.seed):
+    """
+        A tf.data pipeline of (window, {head: target}) batches from the features load(i)
+        of the pieces of indices: every seq_len events of a piece and the event after them,
+        like the training notebook's sequence_generator. Pieces are loaded when they are
+        reached by a parallel map, cycle_length of them are interleaved at once and the
+        windows are shuffled in a buffer of shuffle_buffer, so only those are ever in memory
+        however big the corpus is. With augment the batches are transposed (see transpose)
+        as they are made, the corpus itself is never copied. A piece that can't be loaded
+        is skipped, so the number of batches is only known once an epoch is over.
+    """
+    def load_features(i):
+        try:
+            return load(i)
+        except Exception as e:
+            print("Skipping", i, e)
+            return np.zeros((0, features.NUM_FEATURES), dtype=np.float32)
+
+    def read(i):
+        x = tf.numpy_function(load_features, [i], tf.float32)
+        x.set_shape([None, features.NUM_FEATURES])
+        return x
+
+    def windows(x):
+        starts = tf.data.Dataset.range(tf.maximum(tf.shape(x, out_type=tf.int64)[0] - seq_len, 0))
+        return starts.map(lambda start: (x[start:start + seq_len], features.targets(x[start + seq_len])))
+
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype=np.int64))
+    if shuffle:
+        dataset = dataset.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.map(read, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    dataset = dataset.interleave(windows, cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.batch(batch_size)
+
+    if augment and transpose_offset > 1:
+        dataset = dataset.map(lambda x, y: transpose(x, y, transpose_offset), num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def resume(model, weights_path=config.MidiFiles.weights_path):
+    """
+        Loads the checkpoint of the last epoch in weights_path if there is one, returns
+        its epoch (0 if there is none).
+    """
+    checkpoints = {}
+    for name in os.listdir(weights_path):
+        match = CHECKPOINT_PATTERN.fullmatch(name)
+        if match:
+            checkpoints[int(match.group(1))] = name
+
+    if not checkpoints:
+        return 0
+
+    last_epoch = max(checkpoints)
+    print(f"Resuming from checkpoint: {checkpoints[last_epoch]}")
+    model.load_weights(str(Path(weights_path) / checkpoints[last_epoch]))
+
+    return last_epoch
+
+
+def main(epochs=config.LstmParameters.epochs):
+    weights_path = Path(config.MidiFiles.weights_path)
+    weights_path.mkdir(parents=True, exist_ok=True)
+
+    store = FeatureStore()
+    names, load = piece_source(store)
+    train_indices, validation_indices = split_pieces(len(names))
+    print(f"Training on {len(train_indices)} pieces, validating on {len(validation_indices)}")
+
+    train_dataset = make_dataset(train_indices, load, augment=True)
+    validation_dataset = make_dataset(validation_indices, load, shuffle=False) if len(validation_indices) else None
+
+    model = get_model()
+    model.summary()
+    last_epoch = resume(model, weights_path)
+
+    callbacks = [
+        ModelCheckpoint(
+            filepath=str(weights_path / 'lstm-{epoch:02d}-{loss:.4f}.weights.h5'),
+            save_weights_only=True,
+            monitor='loss',
+            mode='min',
+            save_freq='epoch',
+        ),
+        EarlyStopping(monitor='loss', patience=config.LstmParameters.patience, restore_best_weights=True),
+    ]
+
+    model.fit(train_dataset, validation_data=validation_dataset, epochs=int(epochs), callbacks=callbacks, initial_epoch=last_epoch)
+
+    model.save_weights(str(config.LstmParameters.final_model_path))
+    print(f"Weights saved to {config.LstmParameters.final_model_path}")
+    print(f"Features: {store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import config, asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WriteBehind:
+    """
+        Writes files on a small thread pool behind the async downloads, so the event loop
+        never waits for the disk. Chunks are coalesced into writes of write_size bytes and
+        at most max_buffered bytes are held (buffered or being written) at once, a writer
+        that would go over waits for the disk to catch up.
+    """
+    def __init__(self, threads=config.Crawl.writer_threads, write_size=config.Crawl.write_size, max_buffered=config.Crawl.max_buffered_bytes):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="write-behind")
+        self.write_size = write_size
+        self.max_buffered = max_buffered
+        self.condition = asyncio.Condition()
+
+        self.buffered = 0
+        self.peak = 0
+        self.writes = 0
+        self.bytes = 0
+        self.waited = 0.0
+
+    async def run(self, func, *args):
+        """
+            Runs the blocking func(*args) on the writer threads.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def open(self, path, mode='wb'):
+        return BufferedFile(self, path, mode)
+
+    def has_room(self, size):
+        return self.buffered == 0 or self.buffered + size <= self.max_buffered
+
+    async def reserve(self, size):
+        if not self.has_room(size):
+            start = time.perf_counter()
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.has_room(size))
+            self.waited += time.perf_counter() - start
+
+        self.buffered += size
+        self.peak = max(self.peak, self.buffered)
+
+    async def release(self, size):
+        self.buffered -= size
+        async with self.condition:
+            self.condition.notify_all()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __str__(self):
+        return (f"{self.writes} writes of {self.bytes / 2**20:.1f} MB, peak buffered {self.peak / 2**20:.1f} MB, "
+                f"waited {self.waited:.2f}s for the disk")
+
+
+class BufferedFile:
+    """
+        A file written through a WriteBehind: write() only buffers and queues the data,
+        the writes of one file happen in order on the writer threads. close() waits for
+        all of them and raises if any failed.
+    """
+    def __init__(self, writer, path, mode='wb'):
+        self.writer = writer
+        self.path = path
+        self.mode = mode
+        self.buffer = bytearray()
+        self.tail = None
+        self.file = None
+
+    async def write(self, data):
+        # our own buffer goes to the disk first, so every held byte is on its way out
+        if not self.writer.has_room(len(data)):
+            await self.flush()
+
+        await self.writer.reserve(len(data))
+        self.buffer += data
+
+        if len(self.buffer) >= self.writer.write_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        self.tail = asyncio.ensure_future(self._write_after(self.tail, data))
+
+    async def _write_after(self, previous, data):
+        try:
+            if previous is not None:
+                await previous
+            await self.writer.run(self._write, data)
+        finally:
+            await self.writer.release(len(data))
+
+    def _write(self, data):
+        if self.file is None:
+            self.file = open(self.path, self.mode)
+
+        self.file.write(data)
+        self.writer.writes += 1
+        self.writer.bytes += len(data)
+
+    def _close(self):
+        if self.file is None:
+            self.file = open(self.path, self.mode)
+
+        self.file.close()
+
+    async def close(self):
+        await self.flush()
+        try:
+            if self.tail is not None:
+                await self.tail
+        finally:
+            await self.writer.run(self._close)
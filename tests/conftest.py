@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules import config and src from the root of the repo, like manage.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,20 @@
+import config
+from src import benchmark
+
+
+def test_same_code_is_no_regression(monkeypatch):
+    monkeypatch.setattr(config.Benchmark, "files", 8)
+    monkeypatch.setattr(config.Benchmark, "notes", 500)
+
+    baseline = benchmark.run(repeats=3)
+    results = benchmark.run(repeats=3)
+
+    assert results.keys() == baseline.keys()
+    assert benchmark.find_regressions(results, baseline) == []
+
+
+def test_short_stages_are_not_checked():
+    baseline = {"fused/read": {"files_per_sec": 1000.0, "seconds": 0.001}, "fused/pipeline": {"files_per_sec": 20.0, "seconds": 1.0}}
+    results = {"fused/read": {"files_per_sec": 100.0, "seconds": 0.01}, "fused/pipeline": {"files_per_sec": 10.0, "seconds": 2.0}}
+
+    assert benchmark.find_regressions(results, baseline) == ["fused/pipeline"]
@@ -0,0 +1,49 @@
+import asyncio, hashlib
+import config
+from src import crawl
+from src.download_db import DownloadDB
+from src.mock_server import MockServer
+
+
+def test_known_file_without_validators_is_not_downloaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.MidiFiles, "raw_midi_files", tmp_path / "midi")
+    monkeypatch.setattr(config.MidiFiles, "partial_downloads", tmp_path / "partial")
+    (tmp_path / "midi").mkdir()
+
+    async def main():
+        async with MockServer(composers=1, files_per_composer=3) as server:
+            monkeypatch.setattr(config.Crawl, "base_url", server.base_url)
+            db = DownloadDB(tmp_path / "db.sqlite3")
+
+            # rows like the ones imported from the old db.csv, with no ETag or Last-Modified
+            for name, (body, etag, last_modified) in server.files.items():
+                (tmp_path / "midi" / name).write_bytes(body)
+                db.add({
+                    'Composer': "Composer 0", 'Name': name[:-4], 'FileName': name, 'Url': f"{server.base_url}midi/{name}",
+                    'Sha256': hashlib.sha256(body).hexdigest(), 'Size': len(body),
+                })
+
+            async def callback(row):
+                db.add(row)
+
+            first = await crawl.crawl_composers(None, callback, db.rows(), revalidate=True, progress=False)
+            first_bytes = server.bytes_sent
+
+            # the validators stored by the first crawl make the second one conditional
+            second = await crawl.crawl_composers(None, callback, db.rows(), revalidate=True, progress=False)
+
+            return server, db.rows(), first, first_bytes, second
+
+    server, rows, (stats, first), first_bytes, (stats, second) = asyncio.run(main())
+
+    assert first.downloaded == 0 and first.not_modified == 3 and first.failed == 0
+    assert first_bytes == 0
+    assert server.heads == 3
+
+    for name, (body, etag, last_modified) in server.files.items():
+        row = rows[f"{server.base_url}midi/{name}"]
+        assert (row['ETag'], row['LastModified']) == (etag, last_modified)
+        assert row['Sha256'] == hashlib.sha256(body).hexdigest()
+
+    assert second.downloaded == 0 and second.not_modified == 3
+    assert server.not_modified == 3 and server.bytes_sent == 0
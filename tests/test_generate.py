@@ -0,0 +1,21 @@
+import config, numpy as np
+from src import features
+from src.lstm import get_model, get_step_model
+from src.generate import generate_batch, step_function
+
+
+def test_no_steps_gives_back_the_seeds():
+    rng = np.random.default_rng(0)
+    seq_len = config.LstmParameters.seq_len
+    seeds = [
+        features.encode(np.column_stack([rng.integers(0, 400, length), rng.integers(21, 109, length), rng.integers(1, 1000, length)]))
+        for length in (seq_len, seq_len // 2)
+    ]
+
+    step = step_function(get_step_model(get_model()))
+    sequences = generate_batch(step, seeds, steps=0)
+
+    assert len(sequences) == len(seeds)
+    for seed, sequence in zip(seeds, sequences):
+        assert sequence.shape == seed.shape
+        assert np.array_equal(sequence, seed)